@@ -0,0 +1,183 @@
+import json
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import Quiz, Question, QuizResult, QuestionResult, QuestionStats, TagStats
+
+
+# Доля участников викторины, попадающих в верхнюю и нижнюю группы (классические 27%)
+DISCRIMINATION_GROUP = 0.27
+TOP_ANSWERS = 3
+# Сколько строк ответов читается из курсора за раз
+LOAD_CHUNK_SIZE = 10000
+
+
+# Колонки ответов: по элементу на каждый QuestionResult завершённых викторин.
+# Тексты хранятся кодами: texts[text_codes[i]] - нормализованный текст i-го ответа
+Answers = namedtuple('Answers', ['question_ids', 'result_ids', 'quiz_ids', 'correct', 'text_codes', 'texts'])
+
+
+def normalize_answer(text: str) -> str:
+    return (text or '').strip().lower()
+
+
+def load_answers(session: Session, quizzes_ids=None) -> Answers:
+    """Читает ответы из курсора порциями в заранее выделенные массивы.
+
+    quizzes_ids - id викторин, ответы которых нужны (None - всех).
+    """
+    query = session.query(
+            QuestionResult.question_id, QuestionResult.quiz_result_id, QuizResult.quiz_id,
+            QuestionResult.result, QuestionResult.text)\
+        .join(QuizResult, QuestionResult.quiz_result_id == QuizResult.id)\
+        .filter(QuizResult.finished_query())
+    if quizzes_ids is not None:
+        query = query.filter(QuizResult.quiz_id.in_(quizzes_ids))
+
+    # Ответы, записанные после подсчёта, достанутся следующему пересчёту
+    total = query.count()
+    question_ids = np.empty(total, dtype=np.int64)
+    result_ids = np.empty(total, dtype=np.int64)
+    quiz_ids = np.empty(total, dtype=np.int64)
+    correct = np.empty(total, dtype=bool)
+    text_codes = np.empty(total, dtype=np.int32)
+    codes = {}
+
+    size = 0
+    cursor = session.connection().execution_options(stream_results=True).execute(query.statement)
+    try:
+        while size < total:
+            rows = cursor.fetchmany(LOAD_CHUNK_SIZE)
+            if not rows:
+                break
+            rows = rows[:total - size]
+            end = size + len(rows)
+            columns = list(zip(*rows))
+            question_ids[size:end] = columns[0]
+            result_ids[size:end] = columns[1]
+            quiz_ids[size:end] = columns[2]
+            correct[size:end] = columns[3]
+            text_codes[size:end] = [codes.setdefault(normalize_answer(text), len(codes)) for text in columns[4]]
+            size = end
+    finally:
+        cursor.close()
+
+    return Answers(question_ids[:size], result_ids[:size], quiz_ids[:size], correct[:size],
+        text_codes[:size], list(codes))
+
+
+def question_stats(answers: Answers) -> list:
+    """Решаемость, индекс дискриминации и частые ответы по каждому вопросу"""
+    if len(answers.question_ids) == 0:
+        return []
+
+    question_ids, q_idx = np.unique(answers.question_ids, return_inverse=True)
+    n_questions = len(question_ids)
+    correct = answers.correct.astype(np.float64)
+
+    attempts = np.bincount(q_idx, minlength=n_questions)
+    solved = np.bincount(q_idx, weights=correct, minlength=n_questions)
+    solve_rate = solved / attempts
+
+    upper, lower = _score_groups(answers.result_ids, answers.quiz_ids, correct)
+    upper_n = np.bincount(q_idx, weights=upper, minlength=n_questions)
+    lower_n = np.bincount(q_idx, weights=lower, minlength=n_questions)
+    upper_solved = np.bincount(q_idx, weights=upper * correct, minlength=n_questions)
+    lower_solved = np.bincount(q_idx, weights=lower * correct, minlength=n_questions)
+    has_groups = (upper_n > 0) & (lower_n > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        discrimination = upper_solved / upper_n - lower_solved / lower_n
+
+    top_answers = _top_answers(q_idx, answers.text_codes, answers.texts, n_questions)
+
+    return [
+        dict(
+            question_id=int(question_ids[i]),
+            attempts=int(attempts[i]),
+            solved=int(solved[i]),
+            solve_rate=float(solve_rate[i]),
+            discrimination=float(discrimination[i]) if has_groups[i] else None,
+            top_answers=json.dumps(top_answers[i], ensure_ascii=False),
+        )
+        for i in range(n_questions)
+    ]
+
+
+def tag_stats(session: Session) -> list:
+    """Решаемость по тегам - сумма по уже посчитанной статистике вопросов"""
+    rows = session.query(Quiz.tag, func.sum(QuestionStats.attempts), func.sum(QuestionStats.solved))\
+        .join(Question, QuestionStats.question_id == Question.id)\
+        .join(Quiz, Question.quiz_id == Quiz.id)\
+        .filter((Quiz.tag != None) & (Quiz.tag != ''))\
+        .group_by(Quiz.tag).all()
+    return [
+        dict(tag=tag, attempts=int(attempts), solve_rate=float(solved) / attempts)
+        for tag, attempts, solved in rows
+    ]
+
+
+def _score_groups(result_ids, quiz_ids, correct):
+    """Для каждого ответа: попал ли его автор в верхнюю / нижнюю группу своей викторины"""
+    r_uniq, r_idx = np.unique(result_ids, return_inverse=True)
+    n_results = len(r_uniq)
+    score = np.bincount(r_idx, weights=correct, minlength=n_results) / np.bincount(r_idx, minlength=n_results)
+    r_quiz = np.empty(n_results, dtype=quiz_ids.dtype)
+    r_quiz[r_idx] = quiz_ids
+
+    # Место результата внутри своей викторины -> квантиль
+    order = np.lexsort((score, r_quiz))
+    sorted_quiz = r_quiz[order]
+    group_start = np.searchsorted(sorted_quiz, sorted_quiz, side='left')
+    group_size = np.searchsorted(sorted_quiz, sorted_quiz, side='right') - group_start
+    quantile = np.empty(n_results)
+    quantile[order] = (np.arange(n_results) - group_start + 0.5) / group_size
+
+    upper = (quantile > 1 - DISCRIMINATION_GROUP).astype(np.float64)
+    lower = (quantile < DISCRIMINATION_GROUP).astype(np.float64)
+    return upper[r_idx], lower[r_idx]
+
+
+def _top_answers(q_idx, text_codes, texts, n_questions):
+    n_texts = max(len(texts), 1)
+    pairs, counts = np.unique(q_idx.astype(np.int64) * n_texts + text_codes, return_counts=True)
+    pair_q = pairs // n_texts
+    pair_t = pairs % n_texts
+    order = np.lexsort((-counts, pair_q))
+    pair_q, pair_t, counts = pair_q[order], pair_t[order], counts[order]
+    rank = np.arange(len(pair_q)) - np.searchsorted(pair_q, pair_q, side='left')
+    keep = rank < TOP_ANSWERS
+
+    top = [[] for _ in range(n_questions)]
+    for q, t, count in zip(pair_q[keep], pair_t[keep], counts[keep]):
+        top[q].append([texts[t], int(count)])
+    return top
+
+
+def refresh_stats(session: Session, since: datetime = None):
+    """Пересчитывает сводные таблицы QuestionStats и TagStats.
+
+    since - пересчитать только викторины, в которых после since завершились
+    результаты (None - все). Статистика тегов всегда собирается заново
+    из статистики вопросов.
+    """
+    if since is None:
+        quizzes_ids = None
+        stale = session.query(QuestionStats)
+    else:
+        # Список фиксируется один раз, чтобы удалялась статистика ровно тех викторин, что пересчитаны
+        quizzes_ids = [id for id, in session.query(QuizResult.quiz_id)\
+            .filter(QuizResult.end_time >= since).distinct()]
+        stale = session.query(QuestionStats).filter(QuestionStats.question_id.in_(
+            session.query(Question.id).filter(Question.quiz_id.in_(quizzes_ids))))
+
+    if quizzes_ids != []:
+        questions = question_stats(load_answers(session, quizzes_ids))
+        stale.delete(synchronize_session=False)
+        session.bulk_insert_mappings(QuestionStats, questions)
+
+    session.query(TagStats).delete(synchronize_session=False)
+    session.bulk_insert_mappings(TagStats, tag_stats(session))
@@ -1,6 +1,10 @@
+import asyncio
+import json
 import logging
 import math
-from datetime import datetime
+import weakref
+from collections import defaultdict
+from datetime import datetime, timedelta
 
 from aiogram import Bot, Dispatcher, executor, types
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
@@ -8,41 +12,34 @@ from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.utils.callback_data import CallbackData
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from aiohttp import web
+from sqlalchemy import func
 from sqlalchemy.orm.exc import NoResultFound
 
 import config
 import chgk
-from models import Base, Quiz, Question, QuizResult, QuestionResult
+import analytics
+import maintenance
+import migrations
+from db import engine, Session, session_scope, readiness
+from models import Quiz, Question, QuizResult, QuestionResult, QuestionStats, TagStats, get_quiz_link
+from group_quiz import GroupQuiz, grade_answers
+from timer_wheel import TimerScheduler
+from leaderboard import Leaderboards, LeaderboardEntry
+from cache import TTLCache
+from question_cache import DiskQuestionCache
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-engine = create_engine(config.DATABASE_URL)
-Session = sessionmaker(bind=engine, autoflush=False, expire_on_commit=True)
-Base.metadata.create_all(engine)
-
 bot = Bot(token=config.API_TOKEN)
 dp = Dispatcher(bot, storage=MemoryStorage())
 
 
 #question_storage = chgk.DummyQuestionStorage(100)
-question_storage = chgk.CHGKQuestionStorage()
-
-
-
-class session_scope:
-    def __enter__(self):
-        self._sess = Session()
-        return self._sess
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_val:
-            self._sess.rollback()
-        self._sess.close()
-        if exc_val:
-            raise
+question_storage = chgk.CHGKQuestionStorage(
+    chgk.make_parse_executor(config.PARSE_EXECUTOR, config.PARSE_WORKERS),
+    DiskQuestionCache(config.QUESTION_CACHE_PATH, config.QUESTION_CACHE_MMAP_SIZE) if config.QUESTION_CACHE_PATH else None)
 
 
 QUIZZES_LIST_CD = CallbackData('quizzes', 'page')
@@ -50,6 +47,10 @@ QUIZ_CD = CallbackData('quiz', 'quiz_id', 'action')
 class QuizActions:
     SHOW = 0
     REMOVE = 1
+    LEADERBOARD = 2
+    STATS = 3
+
+QUIZ_STATS_CD = CallbackData('quiz_stats', 'quiz_id', 'page')
 
 QUIZ_RESULTS_LIST_CD = CallbackData('quiz_results', 'quiz_id', 'page')
 QUIZ_RESULT_CD = CallbackData('quiz_result', 'quiz_result_id', 'action')
@@ -97,10 +98,6 @@ def init_db(session: Session):
 
 
 
-def get_quiz_link(quiz_id: int):
-    return f"t.me/osu_tg_quiz_bot?start={quiz_id}"
-
-
 @dp.message_handler(commands=['start'])
 async def start(message: types.Message, state: FSMContext):
     words = message.text.split()
@@ -124,6 +121,13 @@ async def cancel(message: types.Message, state: FSMContext):
         return
     
     logger.info(f"Cancelling state {cur_state}")
+    data = await state.get_data()
+    if 'quiz_result_id' in data:
+        # Отменённая викторина не должна восстанавливаться после перезапуска
+        question_timers.cancel(message.from_user.id)
+        with session_scope() as session:
+            repo_set_question_deadline(session, data['quiz_result_id'], None)
+            session.commit()
     await state.finish()
 
 
@@ -134,6 +138,7 @@ async def cancel(message: types.Message, state: FSMContext):
 class CreateQuizStates(StatesGroup):
     name = State()
     tag = State()
+    time_limit = State()
     count = State()
 
 
@@ -164,7 +169,26 @@ async def new_quiz_process_tag(message: types.Message, state: FSMContext):
     async with state.proxy() as data:
         data['tag'] = message.text
     await CreateQuizStates.next()
-    await bot.send_message(message.from_user.id, '3️⃣ Step three: The Number! (... of questions, of course)')
+    await bot.send_message(message.from_user.id, '3️⃣ Step three: The Time! (seconds for each question, 0 - no limit)')
+
+@dp.message_handler(state=CreateQuizStates.time_limit)
+async def new_quiz_process_time_limit(message: types.Message, state: FSMContext):
+    user_id = message.from_user.id
+
+    try:
+        time_limit = int(message.text)
+    except ValueError:
+        await bot.send_message(user_id, "I expected more from you (a number)")
+        return
+
+    if time_limit < 0 or config.MAX_QUESTION_TIME_LIMIT < time_limit:
+        await bot.send_message(user_id, f"Value out of range (0; {config.MAX_QUESTION_TIME_LIMIT})")
+        return
+
+    async with state.proxy() as data:
+        data['time_limit'] = time_limit or None
+    await CreateQuizStates.next()
+    await bot.send_message(user_id, '4️⃣ Step four: The Number! (... of questions, of course)')
 
 @dp.message_handler(state=CreateQuizStates.count)
 async def new_quiz_process_count(message: types.Message, state: FSMContext):
@@ -181,14 +205,14 @@ async def new_quiz_process_count(message: types.Message, state: FSMContext):
         return
 
     async with state.proxy() as data:
-        name, tag, count = data['name'], data['tag'], int(message.text)
+        name, tag, time_limit, count = data['name'], data['tag'], data['time_limit'], int(message.text)
     await state.finish()
 
     with session_scope() as session:
         chgk_questions_ids = await chgk.get_n_random_questions(question_storage, tag, count)
         logger.debug(f"User {user_id}, tag '{tag}', count {count}, ids {chgk_questions_ids}")
 
-        quiz = Quiz(user_id, name)
+        quiz = Quiz(user_id, name, time_limit, tag)
         for ext_id in chgk_questions_ids:
             quiz.questions.append(Question(quiz.id, ext_id))
         session.add(quiz)
@@ -262,6 +286,10 @@ async def quiz_actions(query: types.CallbackQuery, callback_data: dict):
         kb = types.InlineKeyboardMarkup()
         kb.add( types.InlineKeyboardButton('Results',
             callback_data=QUIZ_RESULTS_LIST_CD.new(quiz_id, 0)) )
+        kb.add( types.InlineKeyboardButton('Leaderboard',
+            callback_data=QUIZ_CD.new(quiz_id, QuizActions.LEADERBOARD)) )
+        kb.add( types.InlineKeyboardButton('Stats',
+            callback_data=QUIZ_CD.new(quiz_id, QuizActions.STATS)) )
         kb.add( types.InlineKeyboardButton('Remove',
             callback_data=QUIZ_CD.new(quiz_id, QuizActions.REMOVE)) )
         # TODO теоретически, через quiz_id мы можем найти страницу
@@ -269,10 +297,88 @@ async def quiz_actions(query: types.CallbackQuery, callback_data: dict):
             callback_data=QUIZZES_LIST_CD.new('0')) )
         await query.message.edit_text(text, reply_markup=kb)
     elif action == QuizActions.REMOVE:
-        with session_scope() as  session:
-            session.query(Quiz).filter_by(id=quiz_id).delete()
+        # Результаты и вопросы удаляются раньше викторины и порциями, как в purge_job
+        chunks = maintenance.remove_quiz(Session, quiz_id, config.PURGE_CHUNK_SIZE)
+        async for name, deleted in in_executor(chunks):
+            await asyncio.sleep(config.PURGE_CHUNK_PAUSE)
+        leaderboards.drop(quiz_id)
         # TODO лучше показывать список
         await query.message.edit_text("Done")
+    elif action == QuizActions.LEADERBOARD:
+        board = leaderboards.get(quiz_id)
+        lines = []
+        for i, entry in enumerate(board.top(config.LEADERBOARD_SIZE), 1):
+            user = await bot.get_chat_member(entry.user_id, entry.user_id)
+            lines.append(f"{i}. @{user.user.full_name} - {entry.score}")
+        text = "Leaderboard\n" + ('\n'.join(lines) if lines else "No results yet")
+        kb = types.InlineKeyboardMarkup()
+        kb.add( types.InlineKeyboardButton('Back',
+            callback_data=QUIZ_CD.new(quiz_id, QuizActions.SHOW)) )
+        await query.message.edit_text(text, reply_markup=kb)
+    elif action == QuizActions.STATS:
+        await show_quiz_stats(query, quiz_id, 0)
+
+
+@dp.callback_query_handler(QUIZ_STATS_CD.filter())
+async def quiz_stats_page(query: types.CallbackQuery, callback_data: dict):
+    page = int(callback_data['page'])
+    await query.answer(str(page + 1))
+    await show_quiz_stats(query, int(callback_data['quiz_id']), page)
+
+
+async def show_quiz_stats(query: types.CallbackQuery, quiz_id: int, page: int):
+    with session_scope() as session:
+        text, total = make_quiz_stats_text(session, quiz_id, page)
+    kb = types.InlineKeyboardMarkup()
+    if total > config.LIST_PAGE_SIZE:
+        kb.add( *make_pagination_buttons(lambda page: QUIZ_STATS_CD.new(quiz_id, page), page, total) )
+    kb.add( types.InlineKeyboardButton('Back',
+        callback_data=QUIZ_CD.new(quiz_id, QuizActions.SHOW)) )
+    await query.message.edit_text(text, reply_markup=kb)
+
+
+def shorten(text: str, length: int):
+    return text if len(text) <= length else text[:length - 1] + '…'
+
+
+def make_quiz_stats_text(session: Session, quiz_id: int, page: int):
+    """Текст страницы статистики и общее число вопросов.
+
+    Вопросы выводятся по LIST_PAGE_SIZE на страницу, а ответы обрезаются,
+    чтобы сообщение не превышало лимит Telegram.
+    """
+    # Статистика берётся из сводных таблиц, которые пересчитывает analytics_job
+    quiz = session.query(Quiz).get(quiz_id)
+    total = len(quiz.questions)
+    start = page * config.LIST_PAGE_SIZE
+    questions = quiz.questions[start:start + config.LIST_PAGE_SIZE]
+    stats = dict(session.query(QuestionStats.question_id, QuestionStats)\
+        .filter(QuestionStats.question_id.in_([q.id for q in questions])).all())
+
+    lines = ["Stats"]
+    if quiz.tag:
+        tag_stats = session.query(TagStats).get(quiz.tag)
+        if tag_stats is not None:
+            lines.append(f"Tag '{quiz.tag}': {tag_stats.solve_rate:.0%} solved ({tag_stats.attempts} answers)")
+    for i, question in enumerate(questions, start + 1):
+        qs = stats.get(question.id)
+        if qs is None:
+            lines.append(f"{i}. {question.ext_id}: no answers yet")
+            continue
+        if qs.solve_rate < config.HARD_QUESTION_RATE:
+            mark = " - too hard"
+        elif qs.solve_rate > config.EASY_QUESTION_RATE:
+            mark = " - too easy"
+        else:
+            mark = ""
+        discrimination = f"{qs.discrimination:.2f}" if qs.discrimination is not None else "-"
+        top_answers = ', '.join(f"{shorten(text, config.STATS_ANSWER_LENGTH) or '<empty>'} ({count})"
+            for text, count in json.loads(qs.top_answers))
+        lines.append(
+            f"{i}. {question.ext_id}: {qs.solve_rate:.0%} solved ({qs.attempts}){mark}\n"
+            f"    discrimination {discrimination}; answers: {top_answers}"
+        )
+    return '\n'.join(lines), total
 
 
 @dp.callback_query_handler(QUIZ_RESULTS_LIST_CD.filter())
@@ -281,11 +387,9 @@ async def quiz_results_list(query: types.CallbackQuery, callback_data: dict):
     page = int(callback_data['page'])
     await query.answer(page)
 
-    with session_scope() as session:
-        sqlq = session.query(QuizResult)\
-            .filter((QuizResult.quiz_id == quiz_id) & QuizResult.finished_query())
-        total = sqlq.count()
-        items = sqlq.offset(page * config.LIST_PAGE_SIZE).limit(config.LIST_PAGE_SIZE)
+    board = leaderboards.get(quiz_id)
+    total = len(board)
+    items = board.page(page, config.LIST_PAGE_SIZE)
     
     kb = types.InlineKeyboardMarkup()
     for item in items:
@@ -293,7 +397,7 @@ async def quiz_results_list(query: types.CallbackQuery, callback_data: dict):
         kb.add(
             types.InlineKeyboardButton(
                 f"@{user.user.full_name} - {item.score} ({item.end_time.date().strftime(config.DATE_FORMAT)})",
-                callback_data=QUIZ_RESULT_CD.new(item.id, QuizResultActions.SHOW)) )
+                callback_data=QUIZ_RESULT_CD.new(item.quiz_result_id, QuizResultActions.SHOW)) )
     
     kb.add( *make_pagination_buttons(lambda page: QUIZ_RESULTS_LIST_CD.new(quiz_id, page), page, total) )
 
@@ -357,6 +461,18 @@ def repo_set_answer(session: Session, quiz_result_id: int, question_id: int, ans
         session.add(question_result)
 
 
+def repo_load_leaderboard(quiz_id: int):
+    with session_scope() as session:
+        rows = session.query(QuizResult.id, QuizResult.user_id, QuizResult.score, QuizResult.end_time)\
+            .filter((QuizResult.quiz_id == quiz_id) & QuizResult.finished_query()).all()
+    return [LeaderboardEntry(*row) for row in rows]
+
+
+def repo_set_question_deadline(session: Session, quiz_result_id: int, deadline: datetime):
+    session.query(QuizResult).filter_by(id=quiz_result_id)\
+        .update({QuizResult.question_deadline: deadline}, synchronize_session=False)
+
+
 def repo_accept_answer(session: Session, quiz_result: QuizResult, question_result: QuestionResult):
     if question_result.result:
         return
@@ -364,6 +480,50 @@ def repo_accept_answer(session: Session, quiz_result: QuizResult, question_resul
     quiz_result.increment_score()
 
 
+def repo_start_group_results(session: Session, quiz_id: int, user_ids: list, skipped_questions_ids: list):
+    """Заводит результаты новым участникам групповой викторины одной пачкой.
+
+    На вопросы, которые участник пропустил до первого ответа, пишутся пустые ответы.
+    """
+    # return_defaults заставил бы делать INSERT на каждую строку, поэтому id
+    # забираются отдельным запросом: пачка отличается от остальных результатов временем начала
+    start_time = datetime.now()
+    session.bulk_insert_mappings(QuizResult, [
+        dict(quiz_id=quiz_id, user_id=user_id, score=0, start_time=start_time, end_time=None)
+        for user_id in user_ids
+    ])
+    new_users = set(user_ids)
+    rows = session.query(QuizResult.user_id, func.max(QuizResult.id))\
+        .filter_by(quiz_id=quiz_id, start_time=start_time, end_time=None)\
+        .group_by(QuizResult.user_id).all()
+    results_ids = {user_id: id for user_id, id in rows if user_id in new_users}
+
+    session.bulk_insert_mappings(QuestionResult, [
+        dict(quiz_result_id=quiz_result_id, question_id=question_id, text='', result=False)
+        for quiz_result_id in results_ids.values()
+        for question_id in skipped_questions_ids
+    ])
+    return results_ids
+
+
+def repo_set_group_answers(session: Session, question_id: int, results_ids: dict, answers: dict, results: dict):
+    session.bulk_insert_mappings(QuestionResult, [
+        dict(quiz_result_id=quiz_result_id, question_id=question_id,
+            text=answers.get(user_id, ''), result=results.get(user_id, False))
+        for user_id, quiz_result_id in results_ids.items()
+    ])
+
+
+def repo_finish_group_results(session: Session, results_ids: dict, scores: dict, total: int, end_time: datetime):
+    session.bulk_update_mappings(QuizResult, [
+        dict(id=quiz_result_id, score=scores.get(user_id, 0) / total * 100, end_time=end_time)
+        for user_id, quiz_result_id in results_ids.items()
+    ])
+
+
+leaderboards = Leaderboards(repo_load_leaderboard, config.LEADERBOARDS_CACHE_SIZE)
+
+
 #
 # Run Quiz
 #
@@ -373,6 +533,13 @@ class RunQuizStates(StatesGroup):
     running = State()
 
 
+# Таймеры ответов на вопросы: ключ - user_id (у пользователя одна активная викторина),
+# payload - (quiz_result_id, question_num), по которому отсекаются устаревшие таймеры
+question_timers = TimerScheduler(config.TIMER_RESOLUTION, config.TIMER_CONCURRENCY)
+# user_id -> asyncio.Lock, шаги викторины одного пользователя выполняются по очереди
+quiz_step_locks = weakref.WeakValueDictionary()
+
+
 async def start_quiz(quiz_id: int, message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     with session_scope() as session:
@@ -386,12 +553,15 @@ async def start_quiz(quiz_id: int, message: types.Message, state: FSMContext):
             data['quiz_result_id'] = quiz_result_id
             data['questions'] = [(q.id, q.ext_id) for q in questions]
             data['question_num'] = 0
+            data['time_limit'] = quiz.time_limit
         
         quiz_info = (
             "Ready for Quiz?\n"
             f"Name: {quiz.name}\n"
             f"Questions: {len(questions)}"
         )
+        if quiz.time_limit:
+            quiz_info += f"\nTime for each question: {quiz.time_limit} sec"
         session.commit()
     await bot.send_message(user_id, quiz_info)
     await run_quiz_iteration(message, state)
@@ -399,56 +569,241 @@ async def start_quiz(quiz_id: int, message: types.Message, state: FSMContext):
 
 @dp.message_handler(state=RunQuizStates.running)
 async def run_quiz_iteration(message: types.Message, state: FSMContext):
-    user_id = message.from_user.id
+    await quiz_step(message.from_user.id, message.text, state)
 
-    is_finish = False
-    async with state.proxy() as data:
-        quiz_result_id = data['quiz_result_id']
-        questions = data['questions']
-        qnum = data['question_num']
 
-        has_answer = qnum > 0
-        has_question = qnum < len(questions)
+async def quiz_step(user_id: int, answer: str, state: FSMContext, timeout: tuple = None):
+    """Записывает ответ на текущий вопрос и задаёт следующий.
 
-        if has_answer:
-            with session_scope() as session:
-                id, ext_id = questions[qnum - 1]
+    timeout - payload сработавшего таймера: шаг выполняется, только если
+    пользователь всё ещё на том вопросе, для которого таймер ставился.
+    """
+    # Ответ и таймаут могут прийти одновременно, а state.proxy не блокирует данные
+    async with quiz_step_lock(user_id):
+        is_finish = False
+        async with state.proxy() as data:
+            if 'quiz_result_id' not in data or \
+                    timeout is not None and (data['quiz_result_id'], data['question_num']) != timeout:
+                # Викторина уже закончилась или пользователь успел ответить, пока срабатывал таймер
+                return
+            # Ответ пришёл - таймер текущего вопроса больше не нужен
+            question_timers.cancel(user_id)
+            if timeout is not None:
+                await bot.send_message(user_id, "Time is up!")
+
+            quiz_result_id = data['quiz_result_id']
+            questions = data['questions']
+            qnum = data['question_num']
+            time_limit = data.get('time_limit')
+
+            has_answer = qnum > 0
+            has_question = qnum < len(questions)
+
+            if has_answer:
+                with session_scope() as session:
+                    id, ext_id = questions[qnum - 1]
+                    chgk_question = await question_storage.get_by_id(ext_id)
+                    result = chgk_question.check_answer(answer)
+                    repo_set_answer(session, quiz_result_id, id, answer, result)
+                    session.commit()
+
+            if has_question:
+                _, ext_id = questions[qnum]
                 chgk_question = await question_storage.get_by_id(ext_id)
-                result = chgk_question.check_answer(message.text)
-                repo_set_answer(session, quiz_result_id, id, message.text, result)
-                session.commit()
+                text = chgk_question.question_text()
+                await bot.send_message(user_id, text)
+                if time_limit:
+                    deadline = datetime.now() + timedelta(seconds=time_limit)
+                    with session_scope() as session:
+                        repo_set_question_deadline(session, quiz_result_id, deadline)
+                        session.commit()
+                    question_timers.schedule(user_id, deadline.timestamp(), (quiz_result_id, qnum + 1))
+            else:
+                # finish quiz
+                is_finish = True
+                with session_scope() as session:
+                    quiz_result = session.query(QuizResult).get(quiz_result_id)
+                    questions_results = quiz_result.questions_results
+                    total = len(questions_results)
+                    good = sum(int(qr.result) for qr in questions_results if qr.result)
+                    quiz_result.set_score(good, total)
+                    quiz_result.end_time = datetime.now()
+                    quiz_result.question_deadline = None
+                    assert len(questions) == total
+                    session.commit()
+
+                    board = leaderboards.get(quiz_result.quiz_id)
+                    board.update(quiz_result.id, user_id, quiz_result.score, quiz_result.end_time)
+                    text = (
+                        f"Done!\n"
+                        f"End time: {quiz_result.end_time.strftime(config.DATETIME_FORMAT)}\n"
+                        f"Your result {good}/{total} ({quiz_result.score})\n"
+                        f"Your rank: {board.rank(quiz_result.id)} of {len(board)}"
+                    )
+                    await bot.send_message(user_id, text)
+
+            qnum += 1
+            data['question_num'] = qnum
+    
+        if is_finish:
+            await state.finish()
+
+
+def quiz_step_lock(user_id: int) -> asyncio.Lock:
+    lock = quiz_step_locks.get(user_id)
+    if lock is None:
+        lock = quiz_step_locks[user_id] = asyncio.Lock()
+    return lock
+
 
-        if has_question:
-            _, ext_id = questions[qnum]
+async def on_question_timeout(user_id: int, payload):
+    state = dp.current_state(chat=user_id, user=user_id)
+    await quiz_step(user_id, '', state, tuple(payload))
+
+
+async def restore_running_quizzes():
+    """Восстанавливает состояния викторин с ограничением времени после перезапуска.
+
+    Состояние FSM хранится в памяти, поэтому собирается заново из БД:
+    номер текущего вопроса - количество уже записанных ответов.
+    Всё читается несколькими запросами на все викторины сразу.
+    """
+    with session_scope() as session:
+        running = ~QuizResult.finished_query() & (QuizResult.question_deadline != None)
+        quiz_results = session.query(
+                QuizResult.id, QuizResult.quiz_id, QuizResult.user_id, QuizResult.question_deadline)\
+            .filter(running).all()
+        answers_counts = dict(session.query(QuestionResult.quiz_result_id, func.count(QuestionResult.id))\
+            .join(QuizResult, QuestionResult.quiz_result_id == QuizResult.id)\
+            .filter(running)\
+            .group_by(QuestionResult.quiz_result_id).all())
+
+        running_quizzes_ids = session.query(QuizResult.quiz_id).filter(running)
+        time_limits = dict(session.query(Quiz.id, Quiz.time_limit)\
+            .filter(Quiz.id.in_(running_quizzes_ids)).all())
+        questions = defaultdict(list)
+        for quiz_id, id, ext_id in session.query(Question.quiz_id, Question.id, Question.ext_id)\
+                .filter(Question.quiz_id.in_(running_quizzes_ids))\
+                .order_by(Question.quiz_id, Question.id):
+            questions[quiz_id].append((id, ext_id))
+
+    for quiz_result_id, quiz_id, user_id, question_deadline in quiz_results:
+        if quiz_id not in time_limits:
+            # Викторину удалили, результат дочистит purge_job
+            continue
+        question_num = answers_counts.get(quiz_result_id, 0) + 1
+
+        state = dp.current_state(chat=user_id, user=user_id)
+        await state.set_state(RunQuizStates.running)
+        await state.set_data({
+            'quiz_id': quiz_id,
+            'quiz_result_id': quiz_result_id,
+            'questions': questions[quiz_id],
+            'question_num': question_num,
+            'time_limit': time_limits[quiz_id],
+        })
+        question_timers.schedule(user_id, question_deadline.timestamp(), (quiz_result_id, question_num))
+    logger.info(f"Restored {len(quiz_results)} running quizzes")
+
+
+
+
+#
+# Group quiz
+#
+
+GROUP_CHAT_TYPES = (types.ChatType.GROUP, types.ChatType.SUPERGROUP)
+
+# chat_id -> GroupQuiz
+group_quizzes = {}
+
+
+@dp.message_handler(lambda message: message.chat.type in GROUP_CHAT_TYPES, commands=['group'])
+async def group_quiz_start(message: types.Message):
+    chat_id = message.chat.id
+    words = message.text.split()
+    if len(words) != 2 or not words[1].isdigit():
+        await message.reply("Usage: /group <quiz_id>")
+        return
+    if chat_id in group_quizzes:
+        await message.reply("Quiz is already running in this chat")
+        return
+
+    quiz_id = int(words[1])
+    with session_scope() as session:
+        quiz = session.query(Quiz).get(quiz_id)
+        if quiz is None:
+            await message.reply("Quiz not found")
+            return
+        name = quiz.name
+        questions = [(q.id, q.ext_id) for q in quiz.questions]
+    if not questions:
+        await message.reply("Quiz has no questions")
+        return
+
+    group_quizzes[chat_id] = GroupQuiz(chat_id, quiz_id, questions)
+    await bot.send_message(chat_id, (
+        "Group quiz!\n"
+        f"Name: {name}\n"
+        f"Questions: {len(questions)}\n"
+        f"You have {config.GROUP_ROUND_SECONDS} seconds for each question, only the first answer counts.\n"
+        "Answer by replying to the question message."
+    ))
+    asyncio.create_task(run_group_quiz(group_quizzes[chat_id]))
+
+
+@dp.message_handler(lambda message: message.chat.id in group_quizzes and not message.is_command())
+async def group_quiz_answer(message: types.Message):
+    # Здесь только буферизация: проверка и запись в БД - раз в раунд
+    # В режиме приватности (по умолчанию) бот получает только реплаи на свои сообщения
+    group = group_quizzes[message.chat.id]
+    reply_to = message.reply_to_message.message_id if message.reply_to_message else None
+    group.submit(message.from_user.id, message.from_user.full_name, message.text, reply_to)
+
+
+async def run_group_quiz(group: GroupQuiz):
+    chat_id = group.chat_id
+    total = len(group.questions)
+    try:
+        for qnum, (question_id, ext_id) in enumerate(group.questions):
             chgk_question = await question_storage.get_by_id(ext_id)
-            text = chgk_question.question_text()
-            await bot.send_message(user_id, text)
-        else:
-            # finish quiz
-            is_finish = True
+
+            question_message = await bot.send_message(chat_id,
+                f"Question {qnum + 1}/{total}\n{chgk_question.question_text()}")
+            group.open_round(qnum, question_message.message_id)
+            await asyncio.sleep(config.GROUP_ROUND_SECONDS)
+            answers = group.close_round()
+
+            results = grade_answers(chgk_question.check_answer, answers)
             with session_scope() as session:
-                quiz_result = session.query(QuizResult).get(quiz_result_id)
-                questions_results = quiz_result.questions_results
-                total = len(questions_results)
-                good = sum(int(qr.result) for qr in questions_results if qr.result)
-                quiz_result.set_score(good, total)
-                quiz_result.end_time = datetime.now()
-                assert len(questions) == total
+                new_users = group.new_participants(answers)
+                if new_users:
+                    skipped_questions_ids = [id for id, _ in group.questions[:qnum]]
+                    group.results_ids.update(
+                        repo_start_group_results(session, group.quiz_id, new_users, skipped_questions_ids))
+                repo_set_group_answers(session, question_id, group.results_ids, answers, results)
                 session.commit()
+            group.apply_results(results)
 
-                text = (
-                    f"Done!\n"
-                    f"End time: {quiz_result.end_time.strftime(config.DATETIME_FORMAT)}\n"
-                    f"Your result {good}/{total} ({quiz_result.score})"
-                )
-                await bot.send_message(user_id, text)
-
-        qnum += 1
-        data['question_num'] = qnum
-    
-    if is_finish:
-        await state.finish()
+            await bot.send_message(chat_id, (
+                f"Right answer: {chgk_question.answer_text()}\n"
+                f"Answers: {len(answers)}, right: {sum(results.values())}\n\n"
+                f"{group.leaderboard_text(config.GROUP_LEADERBOARD_SIZE)}"
+            ))
 
+        end_time = datetime.now()
+        with session_scope() as session:
+            repo_finish_group_results(session, group.results_ids, group.scores, total, end_time)
+            session.commit()
+        board = leaderboards.get(group.quiz_id)
+        for user_id, quiz_result_id in group.results_ids.items():
+            board.update(quiz_result_id, user_id, group.scores.get(user_id, 0) / total * 100, end_time)
+        await bot.send_message(chat_id, f"Done!\n{group.leaderboard_text(config.GROUP_LEADERBOARD_SIZE)}")
+    except Exception:
+        logger.exception(f"Group quiz {group.quiz_id} in chat {chat_id} failed")
+        await bot.send_message(chat_id, "Something went wrong, the quiz is stopped")
+    finally:
+        del group_quizzes[chat_id]
 
 
 
@@ -477,6 +832,9 @@ async def manual_check_iteration(query: types.CallbackQuery, state: FSMContext,
             prev_question_result = sqlq.offset(qnum - 1).first()
             repo_accept_answer(session, quiz_result, prev_question_result)
             session.commit()
+            if quiz_result.finished():
+                leaderboards.get(quiz_result.quiz_id).update(
+                    quiz_result.id, quiz_result.user_id, quiz_result.score, quiz_result.end_time)
         
         if question_result is not None:
             question = question_result.question
@@ -511,8 +869,224 @@ async def manual_check_iteration(query: types.CallbackQuery, state: FSMContext,
 
 
 
-def run_bot():
+#
+# Inline search
+#
+
+# (запрос, страница) -> (total, ids); Telegram шлёт запрос на каждое нажатие, префиксы повторяются
+inline_search_cache = TTLCache(config.INLINE_CACHE_SIZE, config.INLINE_CACHE_TTL)
+# ext_id -> текст вопроса
+inline_preview_cache = TTLCache(config.INLINE_CACHE_SIZE, config.INLINE_CACHE_TTL)
+# user_id -> id последнего inline-запроса, для debounce
+inline_last_query = {}
+
+
+async def fetch_preview(ext_id: str):
+    text = inline_preview_cache.get(ext_id)
+    if text is None:
+        try:
+            chgk_question = await question_storage.get_by_id(ext_id)
+        except Exception as e:
+            logger.debug(f"Preview of '{ext_id}' failed: {e}")
+            return None
+        text = chgk_question.question_text()
+        inline_preview_cache.put(ext_id, text)
+    return text
+
+
+async def fetch_previews(ids: list, timeout: float) -> dict:
+    """Загружает превью параллельно, не дольше timeout.
+
+    Не успевшие загрузки не отменяются - они допишут кэш для следующих запросов.
+    """
+    tasks = {ext_id: asyncio.ensure_future(fetch_preview(ext_id)) for ext_id in ids}
+    if tasks:
+        await asyncio.wait(tasks.values(), timeout=max(timeout, 0))
+    return {ext_id: task.result() for ext_id, task in tasks.items()
+        if task.done() and task.result() is not None}
+
+
+def make_inline_result(ext_id: str, text: str):
+    url = f"https://db.chgk.info/question/{ext_id}"
+    if text is None:
+        title, description = ext_id, "Preview is not loaded yet"
+        message = url
+    else:
+        title, description = text[:config.INLINE_TITLE_LENGTH], ext_id
+        message = f"{text}\n\n{url}"
+    return types.InlineQueryResultArticle(
+        id=ext_id,
+        title=title,
+        description=description,
+        input_message_content=types.InputTextMessageContent(message, disable_web_page_preview=True),
+    )
+
+
+@dp.inline_handler(state='*')
+async def inline_search(query: types.InlineQuery):
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + config.INLINE_LATENCY_BUDGET
+    user_id = query.from_user.id
+    text = query.query.strip()
+    if len(text) < config.INLINE_MIN_QUERY_LENGTH:
+        await query.answer([], cache_time=config.INLINE_CACHE_TTL)
+        return
+
+    inline_last_query[user_id] = query.id
+    await asyncio.sleep(config.INLINE_DEBOUNCE)
+    if inline_last_query.get(user_id) != query.id:
+        # Пользователь продолжает печатать - отвечаем только на последний запрос
+        return
+    del inline_last_query[user_id]
+
+    page = int(query.offset) if query.offset.isdigit() else 0
+    key = (text.lower(), page)
+    found = inline_search_cache.get(key)
+    if found is None:
+        try:
+            found = await asyncio.wait_for(
+                question_storage.find(text, page, config.INLINE_PAGE_SIZE), deadline - loop.time())
+        except Exception as e:
+            logger.debug(f"Inline search '{text}' failed: {e!r}")
+            await query.answer([], cache_time=0)
+            return
+        inline_search_cache.put(key, found)
+    total, ids = found
+
+    previews = await fetch_previews(ids, deadline - loop.time())
+    results = [make_inline_result(ext_id, previews.get(ext_id)) for ext_id in ids]
+    next_offset = str(page + 1) if (page + 1) * config.INLINE_PAGE_SIZE < total else ''
+    # Если какие-то превью не успели загрузиться, ответ не должен надолго закэшироваться в Telegram
+    cache_time = config.INLINE_CACHE_TTL if len(previews) == len(ids) else 0
+    await query.answer(results, cache_time=cache_time, next_offset=next_offset)
+
+
+
+#
+# Background jobs
+#
+
+
+# Время начала последнего пересчёта аналитики и последнего полного пересчёта
+analytics_runs = {'last': None, 'full': None}
+
+
+def refresh_analytics(since: datetime):
     with session_scope() as session:
-        init_db(session)
-    executor.start_polling(dp, skip_updates=True)
+        analytics.refresh_stats(session, since)
+        session.commit()
+
+
+async def analytics_job():
+    start = datetime.now()
+    last, full = analytics_runs['last'], analytics_runs['full']
+    # Ручная проверка и очистка не меняют end_time - их подхватывает только полный пересчёт
+    if full is None or start - full >= timedelta(seconds=config.ANALYTICS_FULL_INTERVAL):
+        since = None
+    else:
+        # Запас на результаты, закоммиченные уже после начала прошлого пересчёта
+        since = last - timedelta(seconds=config.ANALYTICS_OVERLAP)
+
+    # Пересчёт читает ответы и занимает заметное время - выполняется вне цикла событий
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, refresh_analytics, since)
+    analytics_runs['last'] = start
+    if since is None:
+        analytics_runs['full'] = start
+
+
+async def in_executor(iterator):
+    """Асинхронно перебирает синхронный итератор, выполняя каждый шаг в пуле потоков.
+
+    Шаг maintenance.purge / remove_quiz - запрос и удаление порции, они не должны
+    останавливать обработку апдейтов.
+    """
+    loop = asyncio.get_event_loop()
+    done = object()
+    while True:
+        item = await loop.run_in_executor(None, next, iterator, done)
+        if item is done:
+            break
+        yield item
+
+
+async def purge_job():
+    policy = maintenance.RetentionPolicy(
+        abandoned_after=timedelta(hours=config.RETENTION_ABANDONED_HOURS),
+        results_ttl=timedelta(days=config.RETENTION_RESULTS_DAYS) if config.RETENTION_RESULTS_DAYS else None,
+        chunk_size=config.PURGE_CHUNK_SIZE,
+    )
+    totals = {}
+    async for name, deleted in in_executor(maintenance.purge(Session, policy)):
+        totals[name] = totals.get(name, 0) + deleted
+        # Пауза между порциями, чтобы не занимать БД и цикл событий надолго
+        await asyncio.sleep(config.PURGE_CHUNK_PAUSE)
+    if totals.get('expired results'):
+        leaderboards.clear()
+    if totals:
+        logger.info(f"Purged: {totals}")
+
+
+async def run_periodic(interval: int, job):
+    while True:
+        try:
+            result = job()
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception:
+            logger.exception(f"Job {job.__name__} failed")
+        await asyncio.sleep(interval)
+
+
+#
+# Health
+#
+
+
+async def ready(request: web.Request):
+    loop = asyncio.get_event_loop()
+    ok, status = await loop.run_in_executor(None, readiness)
+    status['parse_timings'] = parse_timings_summary()
+    return web.json_response(status, status=200 if ok else 503)
+
+
+def parse_timings_summary():
+    # У заглушек хранилища (DummyQuestionStorage) статистики парсинга нет
+    timings = getattr(question_storage, 'parse_timings', None)
+    return timings.summary() if timings is not None else {}
+
+
+def log_parse_timings():
+    summary = parse_timings_summary()
+    if summary:
+        logger.info(f"Parse timings: {summary}")
+
+
+async def start_health_server(port: int):
+    app = web.Application()
+    app.router.add_get('/ready', ready)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, port=port).start()
+    logger.info(f"Health check is listening on port {port}")
+
+
+async def on_startup(dp: Dispatcher):
+    if config.HEALTH_PORT:
+        await start_health_server(config.HEALTH_PORT)
+    await restore_running_quizzes()
+    asyncio.create_task(question_timers.run(on_question_timeout))
+    asyncio.create_task(run_periodic(config.ANALYTICS_INTERVAL, analytics_job))
+    asyncio.create_task(run_periodic(config.PURGE_INTERVAL, purge_job))
+    asyncio.create_task(run_periodic(config.PARSE_TIMINGS_LOG_INTERVAL, log_parse_timings))
+
+
+def run_bot():
+    migrations.upgrade(engine)
+    if config.SEED_DEMO_DATA:
+        with session_scope() as session:
+            init_db(session)
+    ok, status = readiness()
+    logger.info(f"Database ready: {ok}, {status}")
+    executor.start_polling(dp, skip_updates=True, on_startup=on_startup)
 
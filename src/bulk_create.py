@@ -0,0 +1,125 @@
+"""Массовое создание викторин.
+
+Файл спецификаций - CSV без заголовка, по викторине на строку:
+    owner,name,tag,count[,time_limit]
+owner - id пользователя Telegram, которому будет принадлежать викторина,
+time_limit - секунд на вопрос (0 или пусто - без ограничения).
+Строки, начинающиеся с #, пропускаются. Нужна БД не в памяти (DATABASE_URL).
+
+Вопросы подбираются параллельно, общее число одновременных запросов
+к db.chgk.info ограничено --concurrency. Готовые викторины сохраняются
+пачками по --batch-size в одной транзакции, в stdout печатаются ссылки.
+
+Запуск: python bulk_create.py specs.csv --concurrency 8
+"""
+import sys
+import csv
+import asyncio
+import argparse
+import logging
+from collections import namedtuple
+from typing import List
+
+import config
+import chgk
+import migrations
+from db import engine, session_scope, is_in_memory
+from models import Quiz, Question, get_quiz_link
+from question_cache import DiskQuestionCache
+
+
+logger = logging.getLogger(__name__)
+
+
+QuizSpec = namedtuple('QuizSpec', ['owner', 'name', 'tag', 'count', 'time_limit'])
+
+
+def parse_specs(path: str) -> List[QuizSpec]:
+    specs = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for line_num, row in enumerate(csv.reader(f), 1):
+            if not row or row[0].startswith('#'):
+                continue
+            if len(row) not in (4, 5):
+                raise ValueError(f"{path}:{line_num}: expected owner,name,tag,count[,time_limit]")
+            try:
+                owner, name, tag, count = int(row[0]), row[1].strip(), row[2].strip(), int(row[3])
+                time_limit = int(row[4]) if len(row) == 5 and row[4].strip() else 0
+            except ValueError:
+                raise ValueError(f"{path}:{line_num}: owner, count and time_limit must be numbers")
+            if count < 0 or config.MAX_QUESTIONS_IN_QUIZ < count:
+                raise ValueError(f"{path}:{line_num}: count out of range (0; {config.MAX_QUESTIONS_IN_QUIZ})")
+            if time_limit < 0 or config.MAX_QUESTION_TIME_LIMIT < time_limit:
+                raise ValueError(f"{path}:{line_num}: time_limit out of range (0; {config.MAX_QUESTION_TIME_LIMIT})")
+            # Как и при создании в чате: 0 - без ограничения
+            specs.append(QuizSpec(owner, name, tag, count, time_limit or None))
+    return specs
+
+
+async def generate(specs: List[QuizSpec], storage: chgk.QuestionStorage):
+    """Подбирает вопросы для всех викторин параллельно.
+
+    Возвращает список того же размера: множество id вопросов или исключение.
+    """
+    return await asyncio.gather(
+        *(chgk.get_n_random_questions(storage, spec.tag, spec.count) for spec in specs),
+        return_exceptions=True)
+
+
+def save(specs: List[QuizSpec], questions_ids: list, batch_size: int) -> List[int]:
+    quizzes_ids = []
+    for start in range(0, len(specs), batch_size):
+        with session_scope() as session:
+            quizzes = []
+            for spec, ids in zip(specs[start:start + batch_size], questions_ids[start:start + batch_size]):
+                quiz = Quiz(spec.owner, spec.name, spec.time_limit, spec.tag)
+                quiz.questions = [Question(None, ext_id) for ext_id in ids]
+                quizzes.append(quiz)
+            session.add_all(quizzes)
+            session.commit()
+            quizzes_ids.extend(quiz.id for quiz in quizzes)
+    return quizzes_ids
+
+
+async def main(args):
+    if is_in_memory(config.DATABASE_URL):
+        # Викторины пропали бы вместе с процессом, а ссылки на них уже напечатаны
+        print(f"DATABASE_URL is not set or points to an in-memory database: {config.DATABASE_URL}",
+            file=sys.stderr)
+        return False
+
+    specs = parse_specs(args.specs)
+    executor = chgk.make_parse_executor(config.PARSE_EXECUTOR, config.PARSE_WORKERS)
+    cache = DiskQuestionCache(config.QUESTION_CACHE_PATH, config.QUESTION_CACHE_MMAP_SIZE) \
+        if config.QUESTION_CACHE_PATH else None
+    storage = chgk.LimitedQuestionStorage(chgk.CHGKQuestionStorage(executor, cache), args.concurrency)
+
+    results = await generate(specs, storage)
+
+    ok_specs, ok_ids = [], []
+    for spec, result in zip(specs, results):
+        if isinstance(result, Exception):
+            print(f"FAILED {spec.name} ({spec.tag}, {spec.count}): {result}", file=sys.stderr)
+        else:
+            ok_specs.append(spec)
+            ok_ids.append(result)
+
+    migrations.upgrade(engine)
+    for spec, quiz_id in zip(ok_specs, save(ok_specs, ok_ids, args.batch_size)):
+        print(f"{spec.name}: {get_quiz_link(quiz_id)}")
+
+    return len(ok_specs) == len(specs)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('specs', help="CSV-файл со спецификациями викторин")
+    parser.add_argument('--concurrency', type=int, default=8, help="одновременных запросов к db.chgk.info")
+    parser.add_argument('--batch-size', type=int, default=100, help="викторин в одной транзакции")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    ok = asyncio.get_event_loop().run_until_complete(main(parse_args(sys.argv[1:])))
+    sys.exit(0 if ok else 1)
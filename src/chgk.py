@@ -1,8 +1,11 @@
 from abc import ABCMeta, abstractmethod
-from typing import Tuple, List
+from typing import Tuple, List, Dict
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
 import re
+import time
 import random
 import logging
+import threading
 from html import unescape as html_unescape
 
 import aiohttp
@@ -91,6 +94,22 @@ class DummyQuestionStorage(QuestionStorage):
         return self._total, [str(i) for i in range(start, end)]
 
 
+class LimitedQuestionStorage(QuestionStorage):
+    """Ограничивает число одновременных запросов к другому хранилищу"""
+
+    def __init__(self, storage: QuestionStorage, limit: int):
+        self._storage = storage
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def get_by_id(self, id: str) -> Question:
+        async with self._semaphore:
+            return await self._storage.get_by_id(id)
+
+    async def find(self, content: str, page: int, page_size: int) -> Tuple[int, List[str]]:
+        async with self._semaphore:
+            return await self._storage.find(content, page, page_size)
+
+
 class CHGKQuestion(Question):
     def __init__(self, id, question, answer, other_answer = None):
         self._id = id
@@ -107,6 +126,10 @@ class CHGKQuestion(Question):
     def answer_text(self) -> str:
         return self._answer
 
+    def other_answer_text(self) -> str:
+        """Зачёт (альтернативный ответ), может быть None"""
+        return self._other_answer
+
     def check_answer(self, answer: str) -> bool:
         answer = self.normalize_string(answer)
         return answer == self.normalize_string(self._answer) or answer == self.normalize_string(self._other_answer) \
@@ -118,7 +141,120 @@ class CHGKQuestion(Question):
         return re.findall(r'[\w\d]+', s, re.UNICODE)
 
 
+_xpath_local = threading.local()
+
+def _xpath(expr: str) -> etree.XPath:
+    """Скомпилированное XPath-выражение.
+
+    Компиляция происходит один раз на поток: объекты XPath
+    не стоит делить между потоками пула.
+    """
+    cache = getattr(_xpath_local, 'cache', None)
+    if cache is None:
+        cache = _xpath_local.cache = {}
+    compiled = cache.get(expr)
+    if compiled is None:
+        compiled = cache[expr] = etree.XPath(expr)
+    return compiled
+
+
+SEARCH_TOTAL_XPATH = '//h2[@class="title"]/text()'
+SEARCH_LINKS_XPATH = '//dl[@class="search-results questions-results"]//dd/div[@class="question"]//strong[@class="Question"]//a/@href'
+QUESTION_XPATH = '//Question/text()'
+ANSWER_XPATH = '//Answer/text()'
+PASS_CRITERIA_XPATH = '//PassCriteria'
+TEXT_XPATH = 'text()'
+RAZDATKA_XPATH = '//div[@class="razdatka"]/text()'
+
+
+def parse_search_page(content: str) -> Tuple[int, List[str]]:
+    tree = html.fromstring(content)
+    elems = _xpath(SEARCH_TOTAL_XPATH)(tree)[1]
+    total = re.findall(r'\d+', elems)
+
+    elems = _xpath(SEARCH_LINKS_XPATH)(tree)
+    return int(total[0]), list(map(lambda x: x.replace('/question/', ''), elems))
+
+
+def parse_question_xml(id: str, content: str) -> Question:
+    question_elem = etree.fromstring(content)
+
+    question = _xpath(QUESTION_XPATH)(question_elem)[0]
+    answer = _xpath(ANSWER_XPATH)(question_elem)[0]
+    answer = html_unescape(answer)
+    pass_criteria = _xpath(PASS_CRITERIA_XPATH)(question_elem)
+    if len(pass_criteria) > 0:
+        pass_criteria = pass_criteria[0].text
+        pass_criteria = html_unescape(pass_criteria)
+    else:
+        pass_criteria = None
+
+    question_elem = html.fromstring(question)
+    question = _xpath(TEXT_XPATH)(question_elem)
+    question = ''.join(question).strip().replace('\n', ' ')
+
+    razdatka = _xpath(RAZDATKA_XPATH)(question_elem)
+    if len(razdatka) > 0:
+        razdatka = ''.join(p.lstrip() for p in razdatka if not p.isspace())
+        question = (
+            "Раздаточный материал:\n"
+            f"{razdatka}\n"
+            f"{question}"
+        )
+
+    return CHGKQuestion(id, question, answer, pass_criteria)
+
+
+def _timed(func, *args):
+    # Выполняется в воркере пула, поэтому время не включает ожидание в очереди
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+class ParseTimings:
+    """Статистика времени парсинга по видам страниц"""
+
+    def __init__(self):
+        # kind -> [count, total, max]
+        self._stats: Dict[str, list] = {}
+
+    def add(self, kind: str, seconds: float):
+        stats = self._stats.setdefault(kind, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+
+    def summary(self) -> Dict[str, dict]:
+        return {
+            kind: dict(count=count, total=total, avg=total / count, max=max_)
+            for kind, (count, total, max_) in self._stats.items()
+        }
+
+
+def make_parse_executor(kind: str, workers: int) -> Executor:
+    """kind: 'thread', 'process' или 'none' (парсинг прямо в цикле событий)"""
+    if kind == 'thread':
+        return ThreadPoolExecutor(workers, thread_name_prefix='chgk-parse')
+    if kind == 'process':
+        return ProcessPoolExecutor(workers)
+    if kind == 'none':
+        return None
+    raise ValueError(f"Unknown parse executor '{kind}'")
+
+
 class CHGKQuestionStorage(QuestionStorage):
+    def __init__(self, executor: Executor = None, cache = None):
+        # Парсинг больших страниц занимает десятки миллисекунд - выносим его из цикла событий
+        self._executor = executor
+        self.parse_timings = ParseTimings()
+        # Кэш разобранных вопросов (см. question_cache.DiskQuestionCache), None - без кэша.
+        # Обращения к нему - блокирующий sqlite3, поэтому они идут в своём потоке
+        self._cache = cache
+        self._cache_executor = ThreadPoolExecutor(1, thread_name_prefix='chgk-cache') if cache is not None else None
+        # id -> Future загрузки, чтобы одновременные промахи кэша не дублировали запросы
+        self._loading: Dict[str, asyncio.Future] = {}
+
     async def find(self, content: str, page: int, page_size: int) -> Tuple[int, List[str]]:
         assert page_size < 1000, "Maximum page value - 999"
 
@@ -126,51 +262,54 @@ class CHGKQuestionStorage(QuestionStorage):
             url = f'https://db.chgk.info/search/questions/{content}/types123/limit{page_size}?page={page}'
             async with session.get(url) as response:
                 result = await response.text()
-                return self.parse_result(result)
+        return await self._parse('search', parse_search_page, result)
 
     def parse_result(self, content):
-        tree = html.fromstring(content)
-        elems = tree.xpath('//h2[@class="title"]/text()')[1]
-        total = re.findall(r'\d+', elems)
-
-        elems = tree.xpath('//dl[@class="search-results questions-results"]//dd/div[@class="question"]//strong[@class="Question"]//a/@href')
-        return int(total[0]), list(map(lambda x: x.replace('/question/', ''), elems))
+        return parse_search_page(content)
 
     async def get_by_id(self, id: str) -> Question:
+        if self._cache is None:
+            return await self._load(id)
+
+        cached = await self._in_cache_thread(self._cache.get, id)
+        if cached is not None:
+            return CHGKQuestion(id, *cached)
+
+        loading = self._loading.get(id)
+        if loading is None:
+            loading = self._loading[id] = asyncio.ensure_future(self._load_to_cache(id))
+            loading.add_done_callback(lambda _: self._loading.pop(id, None))
+        return await asyncio.shield(loading)
+
+    async def _load_to_cache(self, id: str) -> Question:
+        question = await self._load(id)
+        await self._in_cache_thread(self._cache.put,
+            id, question.question_text(), question.answer_text(), question.other_answer_text())
+        return question
+
+    async def _in_cache_thread(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._cache_executor, func, *args)
+
+    async def _load(self, id: str) -> Question:
         async with aiohttp.ClientSession() as session:
             url = f'https://db.chgk.info/question/{id}/xml'
             async with session.get(url) as response:
                 content = await response.text()
-                return self.parse_question(id, content)
-
+        return await self._parse('question', parse_question_xml, id, content)
 
     def parse_question(self, id: str, content: str) -> Question:
-        question_elem = etree.fromstring(content)
-
-        question = question_elem.xpath('//Question/text()')[0]
-        answer = question_elem.xpath('//Answer/text()')[0]
-        answer = html_unescape(answer)
-        pass_criteria = question_elem.xpath('//PassCriteria')
-        if len(pass_criteria) > 0:
-            pass_criteria = pass_criteria[0].text
-            pass_criteria = html_unescape(pass_criteria)
+        return parse_question_xml(id, content)
+
+    async def _parse(self, kind: str, func, *args):
+        if self._executor is None:
+            result, elapsed = _timed(func, *args)
         else:
-            pass_criteria = None
-
-        question_elem = html.fromstring(question)
-        question = question_elem.xpath('text()')
-        question = ''.join(question).strip().replace('\n', ' ')
-
-        razdatka = question_elem.xpath('//div[@class="razdatka"]/text()')
-        if len(razdatka) > 0:
-            razdatka = ''.join(p.lstrip() for p in razdatka if not p.isspace())
-            question = (
-                "Раздаточный материал:\n"
-                f"{razdatka}\n"
-                f"{question}"
-            )
-
-        return CHGKQuestion(id, question, answer, pass_criteria)
+            loop = asyncio.get_event_loop()
+            result, elapsed = await loop.run_in_executor(self._executor, _timed, func, *args)
+        self.parse_timings.add(kind, elapsed)
+        logger.debug(f"Parsed {kind} in {elapsed * 1000:.1f} ms")
+        return result
 
 
 
@@ -0,0 +1,98 @@
+import logging
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool, QueuePool
+
+import config
+import migrations
+
+
+logger = logging.getLogger(__name__)
+
+
+def is_in_memory(url: str) -> bool:
+    """SQLite в памяти: данные пропадают вместе с процессом"""
+    url = make_url(url)
+    return url.drivername.startswith('sqlite') and url.database in (None, '', ':memory:')
+
+
+def make_engine(url: str) -> Engine:
+    url = make_url(url)
+    if url.drivername.startswith('sqlite'):
+        if is_in_memory(url):
+            # Одна общая база в памяти на все потоки
+            return create_engine(url, poolclass=StaticPool, connect_args={'check_same_thread': False})
+
+        engine = create_engine(url,
+            poolclass=QueuePool,
+            pool_size=config.DB_POOL_SIZE,
+            max_overflow=config.DB_MAX_OVERFLOW,
+            pool_timeout=config.DB_POOL_TIMEOUT,
+            connect_args={'check_same_thread': False, 'timeout': config.SQLITE_BUSY_TIMEOUT})
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+        return engine
+
+    return create_engine(url,
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_timeout=config.DB_POOL_TIMEOUT,
+        pool_recycle=config.DB_POOL_RECYCLE,
+        pool_pre_ping=True)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL: читатели не блокируют писателя; synchronous=NORMAL в режиме WAL не теряет целостность
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={config.SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}")
+    cursor.close()
+
+
+engine = make_engine(config.DATABASE_URL)
+Session = sessionmaker(bind=engine, autoflush=False, expire_on_commit=True)
+
+
+class session_scope:
+    def __enter__(self):
+        self._sess = Session()
+        return self._sess
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_val:
+            self._sess.rollback()
+        self._sess.close()
+        if exc_val:
+            raise
+
+
+def readiness(engine: Engine = engine):
+    """Проверка готовности БД: соединение, версия схемы и состояние пула.
+
+    Возвращает (ok, status).
+    """
+    pool = engine.pool
+    status = {'pool': pool.status()}
+    if isinstance(pool, QueuePool):
+        status.update(
+            pool_size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+        )
+
+    try:
+        with engine.connect() as conn:
+            conn.execute(text('SELECT 1'))
+            version = migrations.current_version(conn)
+    except Exception as e:
+        logger.warning(f"Database is not ready: {e}")
+        status['database'] = str(e)
+        return False, status
+
+    status['database'] = 'ok'
+    status['schema_version'] = version
+    status['schema_latest'] = migrations.latest_version()
+    return version == migrations.latest_version(), status
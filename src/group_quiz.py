@@ -0,0 +1,87 @@
+import heapq
+from typing import Dict, List, Tuple, Callable
+
+
+class GroupQuiz:
+    """Состояние групповой викторины в одном чате.
+
+    Хранит только то, что нужно между раундами: участников, их очки и
+    буфер ответов текущего раунда. Запись в БД и отправка сообщений
+    делаются снаружи (см. bot.run_group_quiz) - по одному разу на раунд.
+    """
+
+    def __init__(self, chat_id: int, quiz_id: int, questions: List[Tuple[int, str]]):
+        self.chat_id = chat_id
+        self.quiz_id = quiz_id
+        # [(question.id, question.ext_id), ...]
+        self.questions = questions
+        self.question_num = -1
+        # Сообщение с текущим вопросом: ответы можно присылать реплаями на него
+        self.question_message_id = None
+        # user_id -> quiz_result.id
+        self.results_ids: Dict[int, int] = {}
+        # user_id -> количество правильных ответов
+        self.scores: Dict[int, int] = {}
+        self.names: Dict[int, str] = {}
+        self._answers: Dict[int, str] = {}
+        self._is_open = False
+
+    def open_round(self, question_num: int, question_message_id: int = None):
+        self.question_num = question_num
+        self.question_message_id = question_message_id
+        self._answers = {}
+        self._is_open = True
+
+    def submit(self, user_id: int, name: str, answer: str, reply_to_message_id: int = None) -> bool:
+        """Принимает ответ участника. Засчитывается только первый ответ за раунд.
+
+        Реплай засчитывается, только если это реплай на сообщение с текущим вопросом.
+        """
+        if not self._is_open or user_id in self._answers:
+            return False
+        if reply_to_message_id is not None and reply_to_message_id != self.question_message_id:
+            return False
+        self._answers[user_id] = answer
+        self.names[user_id] = name
+        return True
+
+    def close_round(self) -> Dict[int, str]:
+        """Закрывает приём ответов и отдаёт накопленный буфер."""
+        self._is_open = False
+        answers, self._answers = self._answers, {}
+        return answers
+
+    def new_participants(self, answers: Dict[int, str]) -> List[int]:
+        return [user_id for user_id in answers if user_id not in self.results_ids]
+
+    def apply_results(self, results: Dict[int, bool]):
+        for user_id, result in results.items():
+            self.scores[user_id] = self.scores.get(user_id, 0) + int(result)
+
+    def top(self, n: int) -> List[Tuple[int, int]]:
+        return heapq.nlargest(n, self.scores.items(), key=lambda item: item[1])
+
+    def leaderboard_text(self, n: int) -> str:
+        total = self.question_num + 1
+        lines = [
+            f"{i}. {self.names.get(user_id, user_id)} - {good}/{total}"
+            for i, (user_id, good) in enumerate(self.top(n), 1)
+        ]
+        lines.append(f"Participants: {len(self.scores)}")
+        return '\n'.join(lines)
+
+
+def grade_answers(check_answer: Callable[[str], bool], answers: Dict[int, str]) -> Dict[int, bool]:
+    """Проверяет ответы раунда пачкой.
+
+    Одинаковые ответы встречаются часто, поэтому check_answer вызывается
+    один раз на каждый уникальный текст.
+    """
+    checked: Dict[str, bool] = {}
+    results = {}
+    for user_id, answer in answers.items():
+        key = answer.strip().lower()
+        if key not in checked:
+            checked[key] = check_answer(answer)
+        results[user_id] = checked[key]
+    return results
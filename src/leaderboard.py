@@ -0,0 +1,87 @@
+from collections import namedtuple, OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List
+
+from sortedcontainers import SortedList
+
+
+LeaderboardEntry = namedtuple('LeaderboardEntry', ['quiz_result_id', 'user_id', 'score', 'end_time'])
+
+
+class Leaderboard:
+    """Завершённые результаты одной викторины: по убыванию очков, при равенстве - кто раньше закончил.
+
+    Вставка, удаление и поиск места - O(log n).
+    """
+
+    def __init__(self, entries: Iterable[LeaderboardEntry] = ()):
+        self._entries: Dict[int, LeaderboardEntry] = {}
+        self._order = SortedList()
+        for entry in entries:
+            self.update(*entry)
+
+    def __len__(self):
+        return len(self._order)
+
+    def __contains__(self, quiz_result_id):
+        return quiz_result_id in self._entries
+
+    @staticmethod
+    def _key(entry: LeaderboardEntry):
+        return (-entry.score, entry.end_time, entry.quiz_result_id)
+
+    def update(self, quiz_result_id: int, user_id: int, score: float, end_time: datetime):
+        self.remove(quiz_result_id)
+        entry = LeaderboardEntry(quiz_result_id, user_id, score, end_time)
+        self._entries[quiz_result_id] = entry
+        self._order.add(self._key(entry))
+
+    def remove(self, quiz_result_id: int):
+        entry = self._entries.pop(quiz_result_id, None)
+        if entry is not None:
+            self._order.remove(self._key(entry))
+
+    def rank(self, quiz_result_id: int) -> int:
+        """Место результата, начиная с 1"""
+        return self._order.index(self._key(self._entries[quiz_result_id])) + 1
+
+    def page(self, page: int, page_size: int) -> List[LeaderboardEntry]:
+        start = page * page_size
+        return [self._entries[key[2]] for key in self._order[start:start + page_size]]
+
+    def top(self, n: int) -> List[LeaderboardEntry]:
+        return self.page(0, n)
+
+
+class Leaderboards:
+    """Лидерборды викторин в памяти процесса.
+
+    Лидерборд строится одним запросом при первом обращении (load(quiz_id)
+    возвращает завершённые результаты), дальше поддерживается инкрементально.
+    В памяти держатся не больше capacity последних использованных лидербордов.
+    """
+
+    def __init__(self, load: Callable[[int], Iterable[LeaderboardEntry]], capacity: int = 1000):
+        self._load = load
+        self._capacity = capacity
+        # quiz_id -> Leaderboard, от давно использованных к недавним
+        self._boards = OrderedDict()
+
+    def __len__(self):
+        return len(self._boards)
+
+    def get(self, quiz_id: int) -> Leaderboard:
+        board = self._boards.get(quiz_id)
+        if board is None:
+            board = self._boards[quiz_id] = Leaderboard(self._load(quiz_id))
+            if len(self._boards) > self._capacity:
+                self._boards.popitem(last=False)
+        else:
+            self._boards.move_to_end(quiz_id)
+        return board
+
+    def drop(self, quiz_id: int):
+        self._boards.pop(quiz_id, None)
+
+    def clear(self):
+        self._boards.clear()
@@ -0,0 +1,238 @@
+"""Нагрузочный тест диспетчера бота.
+
+Сгенерированные апдейты Telegram подаются прямо в dp.process_update,
+Bot API подменён заглушкой, вопросы берутся из DummyQuestionStorage.
+Каждый виртуальный пользователь проходит викторину (/start <quiz_id> и ответы),
+после чего автор викторины открывает списки и ручную проверку его результата.
+
+Запуск: python loadtest.py --users 200 --concurrency 1,10,100
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import itertools
+import logging
+from collections import defaultdict
+
+# Токен проверяется при создании Bot, а в сеть запросы всё равно не уходят
+os.environ.setdefault('API_TOKEN', '123456789:loadtest')
+# Вопросы всё равно подменяются DummyQuestionStorage - файловый кэш не нужен
+os.environ.setdefault('QUESTION_CACHE_PATH', '')
+
+from aiogram import Bot, Dispatcher, types
+
+import chgk
+import migrations
+import bot as quiz_bot
+from models import Quiz, Question, QuizResult
+
+
+OWNER_ID = 1
+
+
+class FakeBotApi:
+    """Заглушка Bot.request: отвечает на методы API без обращения к Telegram"""
+
+    def __init__(self):
+        self._message_ids = itertools.count(1)
+        self.calls = defaultdict(int)
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        self.calls[method] += 1
+        data = data or {}
+        if method in ('sendMessage', 'editMessageText'):
+            return {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': int(data.get('chat_id') or 0), 'type': 'private'},
+                'text': data.get('text', ''),
+            }
+        if method == 'getChatMember':
+            user_id = int(data['user_id'])
+            return {'user': make_user(user_id), 'status': 'member'}
+        return True
+
+
+class SlowQuestionStorage(chgk.DummyQuestionStorage):
+    """DummyQuestionStorage с искусственной задержкой ответа БД вопросов"""
+
+    def __init__(self, total, latency):
+        super().__init__(total)
+        self._latency = latency
+
+    async def get_by_id(self, id):
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        return await super().get_by_id(id)
+
+
+class UpdateFactory:
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def message(self, user_id, text):
+        message = {
+            'message_id': next(self._ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': make_user(user_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return types.Update(update_id=next(self._ids), message=message)
+
+    def callback(self, user_id, data):
+        return types.Update(update_id=next(self._ids), callback_query={
+            'id': str(next(self._ids)),
+            'chat_instance': 'loadtest',
+            'from': make_user(user_id),
+            'data': data,
+            'message': {
+                'message_id': next(self._ids),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'text': 'loadtest',
+            },
+        })
+
+
+def make_user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f"user{user_id}"}
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[k]
+
+
+def create_quiz(questions_count):
+    with quiz_bot.session_scope() as session:
+        quiz = Quiz(OWNER_ID, 'loadtest')
+        for i in range(questions_count):
+            quiz.questions.append(Question(quiz.id, str(i)))
+        session.add(quiz)
+        session.commit()
+        return quiz.id
+
+
+def find_quiz_result_id(quiz_id, user_id):
+    with quiz_bot.session_scope() as session:
+        return session.query(QuizResult.id)\
+            .filter_by(quiz_id=quiz_id, user_id=user_id)\
+            .order_by(QuizResult.id.desc()).first()[0]
+
+
+class LoadTest:
+    def __init__(self, quiz_id, questions_count):
+        self.quiz_id = quiz_id
+        self.questions_count = questions_count
+        self.updates = UpdateFactory()
+        self.latencies = defaultdict(list)
+
+    async def feed(self, kind, update):
+        start = time.perf_counter()
+        # Как и при polling, каждый апдейт обрабатывается в своей задаче (со своим контекстом)
+        await asyncio.ensure_future(quiz_bot.dp.process_update(update))
+        self.latencies[kind].append(time.perf_counter() - start)
+
+    async def run_user(self, user_id):
+        await self.feed('start', self.updates.message(user_id, f"/start {self.quiz_id}"))
+        for i in range(self.questions_count):
+            answer = f"answer{i}" if i % 2 == 0 else 'wrong'
+            await self.feed('answer', self.updates.message(user_id, answer))
+
+        quiz_result_id = find_quiz_result_id(self.quiz_id, user_id)
+        await self.feed('quizzes_list', self.updates.callback(OWNER_ID, quiz_bot.QUIZZES_LIST_CD.new('0')))
+        await self.feed('quiz', self.updates.callback(OWNER_ID,
+            quiz_bot.QUIZ_CD.new(self.quiz_id, quiz_bot.QuizActions.SHOW)))
+        await self.feed('results_list', self.updates.callback(OWNER_ID,
+            quiz_bot.QUIZ_RESULTS_LIST_CD.new(self.quiz_id, 0)))
+        await self.feed('manual_check', self.updates.callback(OWNER_ID,
+            quiz_bot.QUIZ_RESULT_MANUAL_CHECK_CD.new(quiz_result_id, 0, quiz_bot.ManualCheckActions.INITIAL)))
+        await self.feed('manual_check', self.updates.callback(OWNER_ID,
+            quiz_bot.QUIZ_RESULT_MANUAL_CHECK_CD.new(quiz_result_id, 1, quiz_bot.ManualCheckActions.ACCEPT)))
+
+    async def run(self, user_ids, concurrency):
+        queue = asyncio.Queue()
+        for user_id in user_ids:
+            queue.put_nowait(user_id)
+
+        async def worker():
+            while not queue.empty():
+                await self.run_user(queue.get_nowait())
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - start
+
+
+def print_report(concurrency, elapsed, latencies):
+    all_latencies = sorted(itertools.chain.from_iterable(latencies.values()))
+    steps = len(latencies['answer'])
+    print(
+        f"{concurrency:>11} {len(all_latencies):>8} {elapsed:>8.2f} "
+        f"{len(all_latencies) / elapsed:>10.1f} {steps / elapsed:>8.1f} "
+        f"{percentile(all_latencies, 50) * 1000:>7.2f} "
+        f"{percentile(all_latencies, 95) * 1000:>7.2f} "
+        f"{percentile(all_latencies, 99) * 1000:>7.2f}"
+    )
+
+
+def print_kinds(latencies):
+    print(f"{'handler':>13} {'count':>7} {'p50,ms':>7} {'p95,ms':>7} {'p99,ms':>7}")
+    for kind, values in sorted(latencies.items()):
+        values = sorted(values)
+        print(
+            f"{kind:>13} {len(values):>7} "
+            f"{percentile(values, 50) * 1000:>7.2f} "
+            f"{percentile(values, 95) * 1000:>7.2f} "
+            f"{percentile(values, 99) * 1000:>7.2f}"
+        )
+
+
+async def main(args):
+    fake_api = FakeBotApi()
+    quiz_bot.bot.request = fake_api.request
+    quiz_bot.question_storage = SlowQuestionStorage(args.questions, args.storage_latency / 1000)
+    migrations.upgrade(quiz_bot.engine)
+    Bot.set_current(quiz_bot.bot)
+    Dispatcher.set_current(quiz_bot.dp)
+
+    quiz_id = create_quiz(args.questions)
+    user_ids = itertools.count(OWNER_ID + 1)
+
+    print(f"{'concurrency':>11} {'updates':>8} {'time,s':>8} {'updates/s':>10} {'steps/s':>8} "
+          f"{'p50,ms':>7} {'p95,ms':>7} {'p99,ms':>7}")
+    results = []
+    for concurrency in args.concurrency:
+        test = LoadTest(quiz_id, args.questions)
+        elapsed = await test.run(list(itertools.islice(user_ids, args.users)), concurrency)
+        print_report(concurrency, elapsed, test.latencies)
+        results.append((concurrency, test.latencies))
+
+    if args.per_handler:
+        for concurrency, latencies in results:
+            print(f"\nconcurrency {concurrency}")
+            print_kinds(latencies)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100, help="виртуальных пользователей на каждый уровень")
+    parser.add_argument('--questions', type=int, default=5, help="вопросов в викторине")
+    parser.add_argument('--concurrency', type=lambda s: [int(x) for x in s.split(',')], default=[1, 10, 50],
+        help="уровни параллельности через запятую")
+    parser.add_argument('--storage-latency', type=float, default=0, help="задержка get_by_id, мс")
+    parser.add_argument('--per-handler', action='store_true', help="перцентили по видам апдейтов")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    logging.disable(logging.INFO)
+    asyncio.get_event_loop().run_until_complete(main(args))
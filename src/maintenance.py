@@ -0,0 +1,119 @@
+"""Очистка БД: устаревшие результаты, строки, оставшиеся от удалённых викторин,
+и удаление викторин.
+
+Удаление идёт порциями по первичному ключу, каждая порция - в своей
+короткой транзакции, чтобы не держать блокировки на всю таблицу.
+"""
+import logging
+from collections import namedtuple
+from datetime import datetime
+from typing import Iterator, Tuple
+
+from sqlalchemy import exists, inspect, select
+from sqlalchemy.orm import Session
+
+from models import Quiz, Question, QuizResult, QuestionResult, QuestionStats
+
+
+logger = logging.getLogger(__name__)
+
+
+# abandoned_after - через сколько удалять незавершённые результаты,
+# results_ttl - сколько хранить завершённые (None - бессрочно)
+RetentionPolicy = namedtuple('RetentionPolicy', ['abandoned_after', 'results_ttl', 'chunk_size'])
+
+
+def purge_targets(policy: RetentionPolicy, now: datetime):
+    """Что удаляется: (название, модель, условие).
+
+    Порядок важен: дочерние строки удаляются раньше родительских, чтобы не
+    нарушать внешние ключи, а в конце дочищаются строки, ставшие сиротами
+    раньше (например, в SQLite без проверки внешних ключей).
+    """
+    targets = results_targets('abandoned',
+        ~QuizResult.finished_query() & (QuizResult.start_time < now - policy.abandoned_after))
+    if policy.results_ttl is not None:
+        targets += results_targets('expired',
+            QuizResult.finished_query() & (QuizResult.end_time < now - policy.results_ttl))
+
+    orphan_questions_ids = select([Question.id]).where(~exists().where(Quiz.id == Question.quiz_id))
+    targets += results_targets('orphan', ~exists().where(Quiz.id == QuizResult.quiz_id))
+    targets += [
+        ('orphan answers', QuestionResult, QuestionResult.question_id.in_(orphan_questions_ids)),
+        ('orphan question stats', QuestionStats, QuestionStats.question_id.in_(orphan_questions_ids)),
+        ('orphan questions', Question, ~exists().where(Quiz.id == Question.quiz_id)),
+        ('orphan answers', QuestionResult,
+            ~exists().where(QuizResult.id == QuestionResult.quiz_result_id)
+            | ~exists().where(Question.id == QuestionResult.question_id)),
+        ('orphan question stats', QuestionStats, ~exists().where(Question.id == QuestionStats.question_id)),
+    ]
+    return targets
+
+
+def results_targets(name: str, condition):
+    """Результаты, подходящие под condition, вместе с их ответами"""
+    return [
+        (f"{name} answers", QuestionResult,
+            QuestionResult.quiz_result_id.in_(select([QuizResult.id]).where(condition))),
+        (f"{name} results", QuizResult, condition),
+    ]
+
+
+def quiz_targets(quiz_id: int):
+    """Что удаляется вместе с викториной: (название, модель, условие).
+
+    Дочерние строки идут раньше родительских, чтобы не нарушать внешние ключи.
+    """
+    results_ids = select([QuizResult.id]).where(QuizResult.quiz_id == quiz_id)
+    questions_ids = select([Question.id]).where(Question.quiz_id == quiz_id)
+    return [
+        ('answers', QuestionResult, QuestionResult.quiz_result_id.in_(results_ids)),
+        ('question stats', QuestionStats, QuestionStats.question_id.in_(questions_ids)),
+        ('results', QuizResult, QuizResult.quiz_id == quiz_id),
+        ('questions', Question, Question.quiz_id == quiz_id),
+        ('quiz', Quiz, Quiz.id == quiz_id),
+    ]
+
+
+def delete_chunk(session: Session, model, condition, chunk_size: int) -> int:
+    pk = inspect(model).primary_key[0]
+    ids = [id for id, in session.query(pk).filter(condition).limit(chunk_size)]
+    if ids:
+        session.query(model).filter(pk.in_(ids)).delete(synchronize_session=False)
+    return len(ids)
+
+
+def purge(session_factory, policy: RetentionPolicy, now: datetime = None) -> Iterator[Tuple[str, int]]:
+    """Удаляет строки порциями.
+
+    После каждой закоммиченной порции отдаёт (название, количество), так что
+    вызывающий код может делать паузы между порциями.
+    """
+    if now is None:
+        now = datetime.now()
+    return delete_targets(session_factory, purge_targets(policy, now), policy.chunk_size)
+
+
+def remove_quiz(session_factory, quiz_id: int, chunk_size: int) -> Iterator[Tuple[str, int]]:
+    """Удаляет викторину со всеми результатами и вопросами, порциями как purge"""
+    return delete_targets(session_factory, quiz_targets(quiz_id), chunk_size)
+
+
+def delete_targets(session_factory, targets, chunk_size: int) -> Iterator[Tuple[str, int]]:
+    for name, model, condition in targets:
+        while True:
+            session = session_factory()
+            try:
+                deleted = delete_chunk(session, model, condition, chunk_size)
+                session.commit()
+            except:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+            if deleted:
+                logger.debug(f"Purged {deleted} {name}")
+                yield name, deleted
+            if deleted < chunk_size:
+                break
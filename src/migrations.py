@@ -0,0 +1,146 @@
+"""Версионированные миграции схемы БД.
+
+Миграция - функция, получающая Connection, номер применённой версии
+хранится в таблице schema_version. Новые миграции дописываются в конец
+MIGRATIONS, уже выпущенные не меняются: модели в models.py описывают
+схему после последней миграции.
+
+Запуск: python migrations.py (применяет все миграции к config.DATABASE_URL)
+"""
+import logging
+
+from datetime import datetime
+
+from sqlalchemy import MetaData, Table, Column, Index, Integer, String, DateTime, Boolean, Float, Text, ForeignKey
+from sqlalchemy.engine import Engine, Connection
+
+
+logger = logging.getLogger(__name__)
+
+
+_version_metadata = MetaData()
+schema_version = Table('schema_version', _version_metadata,
+    Column('version', Integer, nullable=False),
+)
+
+
+def _0001_initial(conn: Connection):
+    metadata = MetaData()
+    Table('quiz', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('user_id', Integer, nullable=False),
+        Column('name', String(100), nullable=False),
+        Column('time_limit', Integer, nullable=True),
+        Column('tag', String(100), nullable=True),
+    )
+    Table('question', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('quiz_id', Integer, ForeignKey('quiz.id'), nullable=False),
+        Column('ext_id', String(50), nullable=False),
+    )
+    Table('quizresult', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('quiz_id', Integer, ForeignKey('quiz.id'), nullable=False),
+        Column('user_id', Integer, nullable=False),
+        Column('score', Integer, nullable=False),
+        Column('end_time', DateTime, nullable=True),
+        Column('question_deadline', DateTime, nullable=True),
+    )
+    Table('useranswer', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('quiz_result_id', Integer, ForeignKey('quizresult.id'), nullable=False),
+        Column('question_id', Integer, ForeignKey('question.id'), nullable=False),
+        Column('text', String(100), nullable=False),
+        Column('result', Boolean, nullable=False),
+    )
+    Table('questionstats', metadata,
+        Column('question_id', Integer, ForeignKey('question.id'), primary_key=True),
+        Column('attempts', Integer, nullable=False),
+        Column('solved', Integer, nullable=False),
+        Column('solve_rate', Float, nullable=False),
+        Column('discrimination', Float, nullable=True),
+        Column('top_answers', Text, nullable=False),
+    )
+    Table('tagstats', metadata,
+        Column('tag', String(100), primary_key=True),
+        Column('attempts', Integer, nullable=False),
+        Column('solve_rate', Float, nullable=False),
+    )
+    metadata.create_all(conn)
+
+
+def _0002_retention(conn: Connection):
+    metadata = MetaData()
+    question = Table('question', metadata,
+        Column('quiz_id', Integer),
+    )
+    quizresult = Table('quizresult', metadata,
+        Column('quiz_id', Integer),
+        Column('start_time', DateTime),
+        Column('end_time', DateTime),
+    )
+    useranswer = Table('useranswer', metadata,
+        Column('quiz_result_id', Integer),
+        Column('question_id', Integer),
+    )
+
+    start_time_type = quizresult.c.start_time.type.compile(dialect=conn.dialect)
+    conn.execute(f"ALTER TABLE quizresult ADD COLUMN start_time {start_time_type}")
+    # Незавершённым результатам без времени начала срок хранения отсчитывается от миграции
+    conn.execute(quizresult.update()
+        .where(quizresult.c.start_time == None)
+        .values(start_time=datetime.now()))
+
+    for table, column in [
+        (question, 'quiz_id'),
+        (quizresult, 'quiz_id'),
+        (quizresult, 'start_time'),
+        (quizresult, 'end_time'),
+        (useranswer, 'quiz_result_id'),
+        (useranswer, 'question_id'),
+    ]:
+        Index(f"ix_{table.name}_{column}", table.c[column]).create(conn)
+
+
+MIGRATIONS = [
+    (1, 'initial schema', _0001_initial),
+    (2, 'quiz result start time and indexes for retention', _0002_retention),
+]
+
+
+def latest_version() -> int:
+    return MIGRATIONS[-1][0]
+
+
+def current_version(conn: Connection) -> int:
+    if not conn.dialect.has_table(conn, schema_version.name):
+        return 0
+    version = conn.execute(schema_version.select()).scalar()
+    return version or 0
+
+
+def upgrade(engine: Engine, target: int = None):
+    if target is None:
+        target = latest_version()
+
+    with engine.begin() as conn:
+        schema_version.create(conn, checkfirst=True)
+        if conn.execute(schema_version.select()).first() is None:
+            conn.execute(schema_version.insert().values(version=0))
+
+    for version, description, migrate in MIGRATIONS:
+        if version > target:
+            break
+        # Каждая миграция - в своей транзакции вместе с обновлением номера версии
+        with engine.begin() as conn:
+            if current_version(conn) >= version:
+                continue
+            logger.info(f"Applying migration {version}: {description}")
+            migrate(conn)
+            conn.execute(schema_version.update().values(version=version))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    from db import engine
+    upgrade(engine)
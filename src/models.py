@@ -1,5 +1,7 @@
 
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, MetaData, ForeignKey
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Float, Text, MetaData, ForeignKey
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -11,19 +13,29 @@ class Quiz(Base):
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, nullable=False)
     name = Column(String(100), nullable=False)
+    # Время на ответ на каждый вопрос в секундах, None - без ограничения
+    time_limit = Column(Integer, nullable=True)
+    # Тег, по которому подбирались вопросы
+    tag = Column(String(100), nullable=True)
 
-    def __init__(self, user_id, name):
+    def __init__(self, user_id, name, time_limit = None, tag = None):
         self.user_id = user_id
         self.name = name
+        self.time_limit = time_limit
+        self.tag = tag
     
     def __repr__(self):
         return f"<Quiz {self.id} {self.name}>"
 
+
+def get_quiz_link(quiz_id: int):
+    return f"t.me/osu_tg_quiz_bot?start={quiz_id}"
+
 class Question(Base):
     __tablename__ = 'question'
 
     id = Column(Integer, primary_key=True)
-    quiz_id = Column(Integer, ForeignKey('quiz.id'), nullable=False)
+    quiz_id = Column(Integer, ForeignKey('quiz.id'), nullable=False, index=True)
     # id вопроса в БД ЧГК 
     ext_id = Column(String(50), nullable=False)
 
@@ -40,10 +52,13 @@ class QuizResult(Base):
     __tablename__ = 'quizresult'
     
     id = Column(Integer, primary_key=True)
-    quiz_id = Column(Integer, ForeignKey('quiz.id'), nullable=False)
+    quiz_id = Column(Integer, ForeignKey('quiz.id'), nullable=False, index=True)
     user_id = Column(Integer, nullable=False)
     score = Column(Integer, nullable=False)
-    end_time = Column(DateTime, nullable=True)
+    start_time = Column(DateTime, nullable=True, default=datetime.now, index=True)
+    end_time = Column(DateTime, nullable=True, index=True)
+    # Срок ответа на текущий вопрос (для викторин с ограничением времени)
+    question_deadline = Column(DateTime, nullable=True)
 
     quiz = relationship('Quiz', backref='results')
 
@@ -80,8 +95,8 @@ class QuestionResult(Base):
     __tablename__ = 'useranswer'
 
     id = Column(Integer, primary_key=True)
-    quiz_result_id = Column(Integer, ForeignKey('quizresult.id'), nullable=False)
-    question_id = Column(Integer, ForeignKey('question.id'), nullable=False)
+    quiz_result_id = Column(Integer, ForeignKey('quizresult.id'), nullable=False, index=True)
+    question_id = Column(Integer, ForeignKey('question.id'), nullable=False, index=True)
     text = Column(String(100), nullable=False)
     result = Column(Boolean, nullable=False)
 
@@ -96,3 +111,34 @@ class QuestionResult(Base):
 
     def __repr__(self):
         return f"<UserAnswer {self.result} \"{self.text}\">"
+
+
+# Сводные таблицы аналитики, пересчитываются целиком в analytics.refresh_stats
+
+class QuestionStats(Base):
+    __tablename__ = 'questionstats'
+
+    question_id = Column(Integer, ForeignKey('question.id'), primary_key=True)
+    attempts = Column(Integer, nullable=False)
+    solved = Column(Integer, nullable=False)
+    solve_rate = Column(Float, nullable=False)
+    # Индекс дискриминации: доля решивших в верхней группе минус доля в нижней
+    discrimination = Column(Float, nullable=True)
+    # JSON: [[ответ, количество], ...] - самые частые ответы
+    top_answers = Column(Text, nullable=False)
+
+    question = relationship('Question')
+
+    def __repr__(self):
+        return f"<QuestionStats {self.question_id} {self.solve_rate}>"
+
+
+class TagStats(Base):
+    __tablename__ = 'tagstats'
+
+    tag = Column(String(100), primary_key=True)
+    attempts = Column(Integer, nullable=False)
+    solve_rate = Column(Float, nullable=False)
+
+    def __repr__(self):
+        return f"<TagStats {self.tag} {self.solve_rate}>"
@@ -0,0 +1,47 @@
+import sqlite3
+import threading
+from typing import Optional, Tuple
+
+
+class DiskQuestionCache:
+    """Кэш разобранных вопросов ЧГК в файле SQLite, ключ - ext_id.
+
+    Файл отображается в память (PRAGMA mmap_size), поэтому при старте
+    ничего не читается заранее: страницы подгружаются ОС при обращении,
+    а после перезапуска кэш сразу тёплый.
+    """
+
+    def __init__(self, path: str, mmap_size: int = 256 * 1024 * 1024):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(f'PRAGMA mmap_size={int(mmap_size)}')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS question ('
+                ' ext_id TEXT PRIMARY KEY,'
+                ' question TEXT NOT NULL,'
+                ' answer TEXT NOT NULL,'
+                ' pass_criteria TEXT'
+                ') WITHOUT ROWID')
+
+    def get(self, ext_id: str) -> Optional[Tuple[str, str, Optional[str]]]:
+        """(question, answer, pass_criteria) или None"""
+        with self._lock:
+            return self._conn.execute(
+                'SELECT question, answer, pass_criteria FROM question WHERE ext_id = ?', (ext_id,)).fetchone()
+
+    def put(self, ext_id: str, question: str, answer: str, pass_criteria: Optional[str]):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO question (ext_id, question, answer, pass_criteria) VALUES (?, ?, ?, ?)',
+                (ext_id, question, answer, pass_criteria))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM question').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
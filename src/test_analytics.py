@@ -0,0 +1,124 @@
+import json
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import analytics
+import migrations
+from analytics import Answers, question_stats, load_answers, refresh_stats
+from models import Quiz, Question, QuizResult, QuestionResult, QuestionStats, TagStats
+
+
+NOW = datetime(2021, 3, 1, 12, 0, 0)
+
+
+def make_answers(rows):
+    # rows: (question_id, result_id, quiz_id, correct, text)
+    columns = list(zip(*rows))
+    codes = {}
+    text_codes = [codes.setdefault(analytics.normalize_answer(text), len(codes)) for text in columns[4]]
+    return Answers(
+        np.array(columns[0]), np.array(columns[1]), np.array(columns[2]),
+        np.array(columns[3], dtype=bool), np.array(text_codes, dtype=np.int32), list(codes),
+    )
+
+
+def make_session():
+    engine = create_engine('sqlite:///:memory:')
+    migrations.upgrade(engine)
+    return sessionmaker(bind=engine)()
+
+
+def add_quiz(session, tag, results):
+    """results: [(end_time, [верно ли ответ на каждый вопрос])]"""
+    quiz = Quiz(1, tag, tag=tag)
+    quiz.questions = [Question(None, str(i)) for i in range(len(results[0][1]))]
+    session.add(quiz)
+    session.flush()
+    for end_time, correct in results:
+        result = QuizResult(quiz.id, 1, 0, end_time)
+        for question, ok in zip(quiz.questions, correct):
+            result.questions_results.append(QuestionResult(None, question.id, 'right' if ok else ' Wrong', ok))
+        session.add(result)
+    session.commit()
+    return quiz
+
+
+def test_question_stats():
+    rows = []
+    # 4 участника, вопрос 1 решили все, вопрос 2 - только лучший
+    for result_id in range(4):
+        rows.append((1, result_id, 1, True, 'море'))
+        rows.append((2, result_id, 1, result_id == 0, 'Кит' if result_id == 0 else ' волна'))
+    stats = {s['question_id']: s for s in question_stats(make_answers(rows))}
+
+    assert stats[1]['attempts'] == 4
+    assert stats[1]['solve_rate'] == 1
+    assert stats[1]['discrimination'] == 0
+    assert stats[2]['solve_rate'] == 0.25
+    assert stats[2]['discrimination'] == 1
+    assert json.loads(stats[2]['top_answers']) == [['волна', 3], ['кит', 1]]
+
+
+def test_load_answers(monkeypatch):
+    # Порции меньше числа строк: массивы заполняются за несколько fetchmany
+    monkeypatch.setattr(analytics, 'LOAD_CHUNK_SIZE', 2)
+    session = make_session()
+    quiz = add_quiz(session, 'sea', [(NOW, [True, False]), (NOW, [False, False]), (None, [True, True])])
+    other = add_quiz(session, 'sky', [(NOW, [True])])
+
+    answers = load_answers(session)
+    assert len(answers.question_ids) == 5
+    assert sorted(answers.quiz_ids.tolist()) == [quiz.id] * 4 + [other.id]
+    assert answers.correct.sum() == 2
+    assert sorted(answers.texts[code] for code in answers.text_codes) == ['right'] * 2 + ['wrong'] * 3
+
+    answers = load_answers(session, [other.id])
+    assert answers.quiz_ids.tolist() == [other.id]
+    session.close()
+
+
+def test_refresh_stats_incremental():
+    session = make_session()
+    old = add_quiz(session, 'sea', [(NOW - timedelta(days=1), [True, False])])
+    fresh = add_quiz(session, 'sea', [(NOW - timedelta(days=1), [True])])
+    refresh_stats(session)
+    session.commit()
+    assert session.query(QuestionStats).count() == 3
+    assert session.query(TagStats).get('sea').attempts == 3
+
+    # Новый результат только у fresh; статистику old портим, чтобы увидеть, что она не пересчитывается
+    session.query(QuestionStats).filter(QuestionStats.question_id == old.questions[0].id)\
+        .update({QuestionStats.attempts: 100}, synchronize_session=False)
+    result = QuizResult(fresh.id, 2, 0, NOW)
+    result.questions_results.append(QuestionResult(None, fresh.questions[0].id, 'wrong', False))
+    session.add(result)
+    session.commit()
+
+    refresh_stats(session, since=NOW - timedelta(minutes=10))
+    session.commit()
+    stats = {qs.question_id: qs for qs in session.query(QuestionStats)}
+    assert stats[old.questions[0].id].attempts == 100
+    assert (stats[fresh.questions[0].id].attempts, stats[fresh.questions[0].id].solve_rate) == (2, 0.5)
+    tag = session.query(TagStats).get('sea')
+    assert (tag.attempts, tag.solve_rate) == (103, 2 / 103)
+
+    # Полный пересчёт исправляет всё
+    refresh_stats(session)
+    session.commit()
+    tag = session.query(TagStats).get('sea')
+    assert (tag.attempts, tag.solve_rate) == (4, 0.5)
+    session.close()
+
+
+def test_empty():
+    empty = Answers(*(np.array([], dtype=np.int64) for _ in range(5)), [])
+    assert question_stats(empty) == []
+    session = make_session()
+    refresh_stats(session)
+    refresh_stats(session, since=NOW)
+    assert session.query(QuestionStats).count() == 0
+    assert session.query(TagStats).count() == 0
+    session.close()
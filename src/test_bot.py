@@ -0,0 +1,335 @@
+import os
+import json
+import asyncio
+from types import SimpleNamespace
+
+# Токен проверяется при создании Bot, а в сеть запросы не уходят; БД - в памяти
+os.environ.setdefault('API_TOKEN', '123456789:test')
+os.environ.setdefault('QUESTION_CACHE_PATH', '')
+
+from datetime import datetime, timedelta
+
+from aiogram import Bot, Dispatcher, types
+from sqlalchemy import event
+
+import bot
+import chgk
+import migrations
+from models import Quiz, Question, QuizResult, QuestionResult, QuestionStats
+from test_chgk import async_test
+
+
+migrations.upgrade(bot.engine)
+
+
+def add_quiz(session, questions_count, time_limit=None):
+    quiz = Quiz(1, 'test', time_limit)
+    quiz.questions = [Question(None, str(i)) for i in range(questions_count)]
+    session.add(quiz)
+    session.commit()
+    return quiz
+
+
+class FakeQuery:
+    """CallbackQuery для вызова обработчиков напрямую"""
+
+    def __init__(self, user_id):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.message = SimpleNamespace(edit_text=self._edit_text)
+        self.texts = []
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+    async def _edit_text(self, text, **kwargs):
+        self.texts.append(text)
+
+
+class StatementCounter:
+    def __init__(self, engine):
+        self.statements = []
+        event.listen(engine, 'before_cursor_execute', self._count)
+        self._engine = engine
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def close(self):
+        event.remove(self._engine, 'before_cursor_execute', self._count)
+
+
+def test_group_results():
+    with bot.session_scope() as session:
+        quiz = add_quiz(session, 3)
+        quiz_id = quiz.id
+        q1, q2, q3 = [q.id for q in quiz.questions]
+        # Незавершённый личный прогон той же викторины не должен попасть в групповые результаты
+        bot.repo_start_quiz(session, 1, quiz_id)
+        session.commit()
+
+        users = list(range(1, 1001))
+        counter = StatementCounter(bot.engine)
+        try:
+            results_ids = bot.repo_start_group_results(session, quiz_id, users, [q1])
+        finally:
+            counter.close()
+        session.commit()
+        # Пачка вставок и один запрос id, а не INSERT на каждого участника
+        assert len(counter.statements) <= 3
+        assert set(results_ids) == set(users)
+        assert len(set(results_ids.values())) == len(users)
+        for user_id, quiz_result_id in results_ids.items():
+            assert session.query(QuizResult).get(quiz_result_id).user_id == user_id
+
+        late_ids = bot.repo_start_group_results(session, quiz_id, [2000], [q1, q2])
+        results_ids.update(late_ids)
+        bot.repo_set_group_answers(session, q3, results_ids, {1: 'right', 2: 'wrong'}, {1: True, 2: False})
+        end_time = datetime.now()
+        bot.repo_finish_group_results(session, results_ids, {1: 3, 2: 1}, 3, end_time)
+        session.commit()
+
+        def answers(user_id):
+            return session.query(QuestionResult.question_id, QuestionResult.text, QuestionResult.result)\
+                .filter_by(quiz_result_id=results_ids[user_id]).order_by(QuestionResult.question_id).all()
+
+        assert answers(1) == [(q1, '', False), (q3, 'right', True)]
+        assert answers(3) == [(q1, '', False), (q3, '', False)]
+        assert answers(2000) == [(q1, '', False), (q2, '', False), (q3, '', False)]
+
+        first = session.query(QuizResult).get(results_ids[1])
+        assert (first.score, first.end_time) == (100, end_time)
+        assert session.query(QuizResult).get(results_ids[3]).score == 0
+        assert session.query(QuizResult)\
+            .filter_by(quiz_id=quiz_id).filter(QuizResult.finished_query()).count() == len(results_ids)
+
+
+@async_test
+async def test_stale_timeout_after_answer(monkeypatch):
+    user_id = 42
+    monkeypatch.setattr(bot, 'question_storage', chgk.DummyQuestionStorage(10))
+    sent = []
+    release = asyncio.Event()
+    async def send_message(chat_id, text, **kwargs):
+        sent.append(text)
+        if text == 'question1':
+            await release.wait()
+    monkeypatch.setattr(bot.bot, 'send_message', send_message)
+
+    with bot.session_scope() as session:
+        quiz = add_quiz(session, 2, time_limit=30)
+        questions = [(q.id, q.ext_id) for q in quiz.questions]
+        quiz_result_id = bot.repo_start_quiz(session, user_id, quiz.id)
+        session.commit()
+
+    state = bot.dp.current_state(chat=user_id, user=user_id)
+    await state.set_state(bot.RunQuizStates.running)
+    await state.set_data({'quiz_result_id': quiz_result_id, 'questions': questions,
+        'question_num': 1, 'time_limit': 30})
+    try:
+        # Ответ обрабатывается и отправляет следующий вопрос, в это время срабатывает таймер первого
+        answer = asyncio.ensure_future(bot.quiz_step(user_id, 'answer0', state))
+        while 'question1' not in sent:
+            await asyncio.sleep(0)
+        timeout = asyncio.ensure_future(bot.on_question_timeout(user_id, (quiz_result_id, 1)))
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(answer, timeout)
+
+        assert "Time is up!" not in sent
+        assert (await state.get_data())['question_num'] == 2
+        # Таймер нового вопроса не отменён
+        assert user_id in bot.question_timers.wheel
+        with bot.session_scope() as session:
+            assert session.query(QuestionResult.question_id, QuestionResult.text)\
+                .filter_by(quiz_result_id=quiz_result_id).all() == [(questions[0][0], 'answer0')]
+
+        # Актуальный таймер засчитывает пустой ответ
+        await bot.on_question_timeout(user_id, (quiz_result_id, 2))
+        assert sent[-2] == "Time is up!"
+        assert sent[-1].startswith("Done!")
+        assert await state.get_state() is None
+    finally:
+        bot.question_timers.cancel(user_id)
+        await state.finish()
+
+
+@async_test
+async def test_restore_running_quizzes():
+    users = list(range(1000, 1050))
+    deadline = datetime.now() + timedelta(minutes=5)
+    with bot.session_scope() as session:
+        quiz = add_quiz(session, 3, time_limit=30)
+        quiz_id = quiz.id
+        questions = [(q.id, q.ext_id) for q in quiz.questions]
+        results_ids = {}
+        for i, user_id in enumerate(users):
+            result = QuizResult(quiz_id, user_id, 0, None)
+            result.question_deadline = deadline
+            for question_id, _ in questions[:i % 3]:
+                result.questions_results.append(QuestionResult(None, question_id, '', False))
+            session.add(result)
+            session.flush()
+            results_ids[user_id] = result.id
+        finished = QuizResult(quiz_id, 2000, 100, datetime.now())
+        finished.question_deadline = deadline
+        session.add(finished)
+        session.commit()
+
+    counter = StatementCounter(bot.engine)
+    try:
+        await bot.restore_running_quizzes()
+    finally:
+        counter.close()
+    try:
+        # Число запросов не зависит от количества восстанавливаемых викторин
+        assert len(counter.statements) <= 4
+        for i, user_id in enumerate(users):
+            state = bot.dp.current_state(chat=user_id, user=user_id)
+            assert await state.get_state() == bot.RunQuizStates.running.state
+            assert await state.get_data() == {
+                'quiz_id': quiz_id,
+                'quiz_result_id': results_ids[user_id],
+                'questions': questions,
+                'question_num': i % 3 + 1,
+                'time_limit': 30,
+            }
+            assert user_id in bot.question_timers.wheel
+        assert 2000 not in bot.question_timers.wheel
+    finally:
+        for user_id in users:
+            bot.question_timers.cancel(user_id)
+            await bot.dp.current_state(chat=user_id, user=user_id).finish()
+
+
+@async_test
+async def test_quiz_stats_pages_fit_message_limit():
+    questions_count = 30
+    with bot.session_scope() as session:
+        quiz = add_quiz(session, questions_count)
+        quiz.tag = 't' * 100
+        quiz_id = quiz.id
+        for user_id in range(10):
+            result = QuizResult(quiz_id, user_id, 0, datetime.now())
+            for question in quiz.questions:
+                text = f"{user_id % 4} " + 'x' * 98
+                result.questions_results.append(QuestionResult(None, question.id, text, user_id % 2 == 0))
+            session.add(result)
+        session.commit()
+
+    await bot.analytics_job()
+
+    numbers = []
+    with bot.session_scope() as session:
+        for page in range(bot.math.ceil(questions_count / bot.config.LIST_PAGE_SIZE)):
+            text, total = bot.make_quiz_stats_text(session, quiz_id, page)
+            assert total == questions_count
+            assert len(text) < 4096
+            numbers += [int(line.split('.')[0]) for line in text.split('\n') if line[0].isdigit()]
+    assert numbers == list(range(1, questions_count + 1))
+
+
+@async_test
+async def test_remove_quiz(monkeypatch):
+    monkeypatch.setattr(bot.config, 'PURGE_CHUNK_SIZE', 2)
+    monkeypatch.setattr(bot.config, 'PURGE_CHUNK_PAUSE', 0)
+    with bot.session_scope() as session:
+        quiz = add_quiz(session, 3)
+        quiz_id = quiz.id
+        for user_id in range(3):
+            result = QuizResult(quiz_id, user_id, 0, datetime.now())
+            for question in quiz.questions:
+                result.questions_results.append(QuestionResult(None, question.id, '', False))
+            session.add(result)
+        session.add(QuestionStats(question_id=quiz.questions[0].id,
+            attempts=3, solved=0, solve_rate=0, top_answers='[]'))
+        session.commit()
+    assert len(bot.leaderboards.get(quiz_id)) == 3
+
+    # Как в PostgreSQL: внешние ключи проверяются (соединение с БД в памяти одно на всех)
+    with bot.engine.connect() as conn:
+        conn.execute('PRAGMA foreign_keys=ON')
+    try:
+        query = FakeQuery(1)
+        await bot.quiz_actions(query, {'quiz_id': str(quiz_id), 'action': str(bot.QuizActions.REMOVE)})
+    finally:
+        with bot.engine.connect() as conn:
+            conn.execute('PRAGMA foreign_keys=OFF')
+
+    assert query.texts == ["Done"]
+    with bot.session_scope() as session:
+        assert session.query(Quiz).get(quiz_id) is None
+        assert session.query(Question).filter_by(quiz_id=quiz_id).count() == 0
+        assert session.query(QuizResult).filter_by(quiz_id=quiz_id).count() == 0
+        assert session.query(QuestionResult).join(QuizResult).filter(QuizResult.quiz_id == quiz_id).count() == 0
+        assert session.query(QuestionStats).join(Question).filter(Question.quiz_id == quiz_id).count() == 0
+    assert len(bot.leaderboards.get(quiz_id)) == 0
+
+
+@async_test
+async def test_inline_search_in_any_state(monkeypatch):
+    user_id = 43
+    monkeypatch.setattr(bot, 'question_storage', chgk.DummyQuestionStorage(3))
+    monkeypatch.setattr(bot.config, 'INLINE_DEBOUNCE', 0)
+    answers = []
+    async def request(method, data=None, files=None, **kwargs):
+        answers.append((method, data))
+        return True
+    monkeypatch.setattr(bot.bot, 'request', request)
+    Bot.set_current(bot.bot)
+    Dispatcher.set_current(bot.dp)
+
+    # Автор как раз создаёт викторину и ищет вопросы
+    state = bot.dp.current_state(chat=user_id, user=user_id)
+    await state.set_state(bot.CreateQuizStates.tag)
+    try:
+        update = types.Update(update_id=1, inline_query={
+            'id': 'q1', 'from': {'id': user_id, 'is_bot': False, 'first_name': 'author'},
+            'query': 'history', 'offset': '',
+        })
+        await asyncio.ensure_future(bot.dp.process_update(update))
+    finally:
+        await state.finish()
+
+    assert [method for method, _ in answers] == ['answerInlineQuery']
+    assert len(json.loads(answers[0][1]['results'])) == 3
+
+
+@async_test
+async def test_ready_reports_parse_timings(monkeypatch):
+    storage = chgk.CHGKQuestionStorage()
+    storage.parse_timings.add('question', 0.02)
+    monkeypatch.setattr(bot, 'question_storage', storage)
+
+    response = await bot.ready(None)
+    status = json.loads(response.text)
+    assert response.status == 200
+    assert status['parse_timings']['question']['count'] == 1
+
+    monkeypatch.setattr(bot, 'question_storage', chgk.DummyQuestionStorage(1))
+    assert json.loads((await bot.ready(None)).text)['parse_timings'] == {}
+
+
+@async_test
+async def test_purge_job(monkeypatch):
+    monkeypatch.setattr(bot.config, 'PURGE_CHUNK_PAUSE', 0)
+    with bot.session_scope() as session:
+        quiz = add_quiz(session, 2)
+        result = QuizResult(quiz.id, 1, 0, None)
+        result.start_time = datetime.now() - timedelta(hours=bot.config.RETENTION_ABANDONED_HOURS + 1)
+        for question in quiz.questions:
+            result.questions_results.append(QuestionResult(None, question.id, '', False))
+        session.add(result)
+        session.commit()
+        result_id = result.id
+
+    with bot.engine.connect() as conn:
+        conn.execute('PRAGMA foreign_keys=ON')
+    try:
+        await bot.purge_job()
+    finally:
+        with bot.engine.connect() as conn:
+            conn.execute('PRAGMA foreign_keys=OFF')
+
+    with bot.session_scope() as session:
+        assert session.query(QuizResult).get(result_id) is None
+        assert session.query(QuestionResult).filter_by(quiz_result_id=result_id).count() == 0
@@ -0,0 +1,78 @@
+import pytest
+from sqlalchemy import event
+
+import db
+import migrations
+from bulk_create import QuizSpec, parse_specs, save, main, parse_args
+from models import Quiz, Question
+from test_chgk import async_test
+
+
+def write_specs(tmp_path, text):
+    path = tmp_path / 'specs.csv'
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def test_parse_specs(tmp_path):
+    path = write_specs(tmp_path, (
+        "# owner,name,tag,count[,time_limit]\n"
+        "\n"
+        "1, First , history ,10\n"
+        "2,Second,,5,30\n"
+        "3,Third,music,0,0\n"
+        "4,\"Fourth, quoted\",music,3,\n"
+    ))
+    assert parse_specs(path) == [
+        QuizSpec(1, 'First', 'history', 10, None),
+        QuizSpec(2, 'Second', '', 5, 30),
+        QuizSpec(3, 'Third', 'music', 0, None),
+        QuizSpec(4, 'Fourth, quoted', 'music', 3, None),
+    ]
+
+
+@pytest.mark.parametrize('row, error', [
+    ("1,name,tag", 'expected owner,name,tag,count'),
+    ("1,name,tag,5,30,extra", 'expected owner,name,tag,count'),
+    ("user,name,tag,5", 'owner, count and time_limit must be numbers'),
+    ("1,name,tag,five", 'owner, count and time_limit must be numbers'),
+    ("1,name,tag,5,1.5", 'owner, count and time_limit must be numbers'),
+    ("1,name,tag,31", 'count out of range'),
+    ("1,name,tag,-1", 'count out of range'),
+    ("1,name,tag,5,601", 'time_limit out of range'),
+    ("1,name,tag,5,-1", 'time_limit out of range'),
+])
+def test_parse_specs_bad_row(tmp_path, row, error):
+    path = write_specs(tmp_path, f"1,ok,tag,5\n{row}\n")
+    with pytest.raises(ValueError, match=f":2: {error}"):
+        parse_specs(path)
+
+
+def test_save_batches():
+    migrations.upgrade(db.engine)
+    commits = []
+    listener = lambda session: commits.append(session)
+    event.listen(db.Session, 'after_commit', listener)
+    try:
+        specs = [QuizSpec(1, f"quiz{i}", 'tag', i % 3, 30 if i % 2 else None) for i in range(7)]
+        questions_ids = [[f"{i}/{j}" for j in range(spec.count)] for i, spec in enumerate(specs)]
+        quizzes_ids = save(specs, questions_ids, batch_size=3)
+    finally:
+        event.remove(db.Session, 'after_commit', listener)
+
+    assert len(commits) == 3
+    assert len(set(quizzes_ids)) == len(specs)
+    with db.session_scope() as session:
+        for spec, ids, quiz_id in zip(specs, questions_ids, quizzes_ids):
+            quiz = session.query(Quiz).get(quiz_id)
+            assert (quiz.name, quiz.tag, quiz.time_limit) == (spec.name, spec.tag, spec.time_limit)
+            assert sorted(q.ext_id for q in quiz.questions) == sorted(ids)
+
+
+@async_test
+async def test_refuses_in_memory_database(tmp_path, capsys):
+    # В тестах DATABASE_URL не задан - используется БД в памяти
+    assert db.is_in_memory(db.config.DATABASE_URL)
+    path = write_specs(tmp_path, "1,name,tag,5\n")
+    assert await main(parse_args([path])) is False
+    assert 'in-memory' in capsys.readouterr().err
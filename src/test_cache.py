@@ -0,0 +1,30 @@
+from cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl():
+    clock = FakeClock()
+    cache = TTLCache(10, 5, clock)
+    cache.put('a', 1)
+    assert cache.get('a') == 1
+    clock.now = 5
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_lru():
+    cache = TTLCache(2, 100, FakeClock())
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert cache.get('c') == 3
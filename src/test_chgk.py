@@ -1,12 +1,17 @@
 import asyncio
+import functools
+import threading
 import string
 
-from chgk import DummyQuestionStorage, CHGKQuestionStorage, CHGKQuestion, get_n_random_questions
+from chgk import DummyQuestionStorage, CHGKQuestionStorage, CHGKQuestion, get_n_random_questions, \
+    make_parse_executor, parse_question_xml
+from question_cache import DiskQuestionCache
 
 
 # Простой вариант
 # Потом мб заменить на pytest.mark.asyncio из pytest-asyncio
 def async_test(coro):
+    @functools.wraps(coro)
     def wrapper(*args, **kwargs):
         loop = asyncio.new_event_loop()
         try:
@@ -76,4 +81,78 @@ async def test_chgk_get_random():
     qs = CHGKQuestionStorage()
 
     links = await get_n_random_questions(qs, 'море', 10)
-    assert len(links) == 10
\ No newline at end of file
+    assert len(links) == 10
+
+QUESTION_XML = (
+    '<?xml version="1.0" encoding="utf-8"?>\n'
+    '<search><question>'
+    '<Question>&lt;div class="razdatka"&gt;\n Раздатка &lt;/div&gt;\nТекст\nвопроса</Question>'
+    '<Answer>Море &amp; океан</Answer>'
+    '<PassCriteria>Океан</PassCriteria>'
+    '</question></search>'
+)
+
+
+@async_test
+async def test_chgk_parse_in_executor():
+    for kind in ('none', 'thread', 'process'):
+        executor = make_parse_executor(kind, 2)
+        qs = CHGKQuestionStorage(executor)
+        try:
+            q = await qs._parse('question', parse_question_xml, 'id/1', QUESTION_XML.encode())
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        assert q.question_text() == "Раздаточный материал:\nРаздатка \nТекст вопроса"
+        assert q.answer_text() == 'Море & океан'
+        assert q.check_answer('океан')
+        assert qs.parse_timings.summary()['question']['count'] == 1
+
+
+@async_test
+async def test_chgk_cache_read_through(tmp_path):
+    cache = DiskQuestionCache(str(tmp_path / 'questions.db'))
+    qs = CHGKQuestionStorage(cache=cache)
+    loads = []
+
+    async def load(id):
+        loads.append(id)
+        await asyncio.sleep(0.01)
+        return CHGKQuestion(id, 'question', 'answer', 'other')
+    qs._load = load
+
+    questions = await asyncio.gather(*(qs.get_by_id('id/1') for _ in range(5)))
+    assert loads == ['id/1']
+    assert all(q.answer_text() == 'answer' for q in questions)
+
+    # Новый экземпляр (как после перезапуска) читает из файла, без загрузки
+    qs = CHGKQuestionStorage(cache=cache)
+    qs._load = load
+    q = await qs.get_by_id('id/1')
+    assert loads == ['id/1']
+    assert q.check_answer('other')
+
+
+@async_test
+async def test_chgk_cache_off_event_loop():
+    threads = []
+
+    class RecordingCache:
+        def __init__(self):
+            self._data = {}
+        def get(self, id):
+            threads.append(threading.current_thread())
+            return self._data.get(id)
+        def put(self, id, *question):
+            threads.append(threading.current_thread())
+            self._data[id] = question
+
+    qs = CHGKQuestionStorage(cache=RecordingCache())
+    async def load(id):
+        return CHGKQuestion(id, 'question', 'answer', None)
+    qs._load = load
+
+    await qs.get_by_id('id/1')
+    await qs.get_by_id('id/1')
+    assert len(threads) == 3
+    assert threading.main_thread() not in threads
@@ -0,0 +1,77 @@
+from group_quiz import GroupQuiz, grade_answers
+
+
+QUESTIONS = [(1, 'q1'), (2, 'q2'), (3, 'q3')]
+
+
+def test_only_first_answer_counts():
+    group = GroupQuiz(100, 7, QUESTIONS)
+    assert not group.submit(1, 'alice', 'early')
+
+    group.open_round(0)
+    assert group.submit(1, 'alice', 'first')
+    assert not group.submit(1, 'alice', 'second')
+    assert group.submit(2, 'bob', 'answer')
+    assert group.close_round() == {1: 'first', 2: 'answer'}
+
+    # После закрытия раунда ответы не принимаются, буфер пуст
+    assert not group.submit(3, 'carol', 'late')
+    assert group.close_round() == {}
+
+
+def test_new_participants():
+    group = GroupQuiz(100, 7, QUESTIONS)
+    assert group.new_participants({1: 'a', 2: 'b'}) == [1, 2]
+    group.results_ids.update({1: 11, 2: 12})
+    assert group.new_participants({2: 'b', 3: 'c'}) == [3]
+
+
+def test_scores_and_leaderboard():
+    group = GroupQuiz(100, 7, QUESTIONS)
+    group.open_round(0)
+    group.submit(1, 'alice', 'a')
+    group.submit(2, 'bob', 'b')
+    group.close_round()
+    group.apply_results({1: True, 2: False})
+
+    group.open_round(1)
+    group.submit(2, 'bob', 'b')
+    group.submit(3, 'carol', 'c')
+    group.close_round()
+    group.apply_results({2: True, 3: True})
+
+    assert group.scores == {1: 1, 2: 1, 3: 1}
+    group.apply_results({3: True})
+    assert group.top(1) == [(3, 2)]
+    assert group.leaderboard_text(2).split('\n') == [
+        "1. carol - 2/2",
+        "2. alice - 1/2",
+        "Participants: 3",
+    ]
+
+
+def test_grade_answers_checks_unique_texts_once():
+    calls = []
+    def check_answer(answer):
+        calls.append(answer)
+        return answer.strip().lower() == 'right'
+
+    results = grade_answers(check_answer, {1: 'Right', 2: ' right ', 3: 'wrong', 4: 'RIGHT', 5: 'Wrong'})
+    assert results == {1: True, 2: True, 3: False, 4: True, 5: False}
+    assert len(calls) == 2
+    assert grade_answers(check_answer, {}) == {}
+
+
+def test_replies_only_to_current_question():
+    group = GroupQuiz(100, 7, QUESTIONS)
+    group.open_round(0, question_message_id=10)
+    # Реплай на другое сообщение - не ответ
+    assert not group.submit(1, 'alice', 'chat', reply_to_message_id=5)
+    assert group.submit(1, 'alice', 'answer', reply_to_message_id=10)
+    # Без реплая (режим приватности отключён) ответ тоже принимается
+    assert group.submit(2, 'bob', 'answer')
+    group.close_round()
+
+    group.open_round(1, question_message_id=11)
+    assert not group.submit(1, 'alice', 'late', reply_to_message_id=10)
+    assert group.close_round() == {}
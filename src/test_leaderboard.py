@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+from leaderboard import Leaderboard, Leaderboards, LeaderboardEntry
+
+
+T0 = datetime(2021, 3, 1, 12, 0, 0)
+
+
+def test_order_by_score_then_time():
+    board = Leaderboard([
+        LeaderboardEntry(1, 10, 50, T0),
+        LeaderboardEntry(2, 20, 100, T0 + timedelta(minutes=5)),
+        LeaderboardEntry(3, 30, 100, T0),
+    ])
+    assert [e.quiz_result_id for e in board.top(10)] == [3, 2, 1]
+    assert board.rank(1) == 3
+    assert len(board) == 3
+
+
+def test_update_changes_rank():
+    board = Leaderboard()
+    board.update(1, 10, 50, T0)
+    board.update(2, 20, 75, T0)
+    assert board.rank(1) == 2
+    # Ручная проверка засчитала ответ
+    board.update(1, 10, 100, T0)
+    assert board.rank(1) == 1
+    assert len(board) == 2
+
+
+def test_page():
+    board = Leaderboard(LeaderboardEntry(i, i, i, T0) for i in range(12))
+    assert [e.score for e in board.page(1, 5)] == [6, 5, 4, 3, 2]
+    assert [e.score for e in board.page(2, 5)] == [1, 0]
+
+
+def test_lazy_load():
+    loads = []
+    def load(quiz_id):
+        loads.append(quiz_id)
+        return [LeaderboardEntry(1, 10, 50, T0)]
+
+    boards = Leaderboards(load)
+    boards.get(7).update(2, 20, 60, T0)
+    assert len(boards.get(7)) == 2
+    assert loads == [7]
+    boards.drop(7)
+    assert len(boards.get(7)) == 1
+    assert loads == [7, 7]
+
+
+def test_capacity():
+    loads = []
+    def load(quiz_id):
+        loads.append(quiz_id)
+        return []
+
+    boards = Leaderboards(load, capacity=2)
+    boards.get(1)
+    boards.get(2)
+    boards.get(1)
+    # Вытесняется давно не использованный лидерборд
+    boards.get(3)
+    assert len(boards) == 2
+    boards.get(1)
+    assert loads == [1, 2, 3]
+    boards.get(2)
+    assert loads == [1, 2, 3, 2]
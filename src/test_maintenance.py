@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+import migrations
+from maintenance import RetentionPolicy, purge, remove_quiz
+from models import Quiz, Question, QuizResult, QuestionResult, QuestionStats
+
+
+NOW = datetime(2021, 3, 1, 12, 0, 0)
+
+
+def make_session_factory(foreign_keys=False):
+    engine = create_engine('sqlite:///:memory:')
+    if foreign_keys:
+        # Как в PostgreSQL: внешние ключи проверяются
+        event.listen(engine, 'connect', lambda conn, record: conn.execute('PRAGMA foreign_keys=ON'))
+    migrations.upgrade(engine)
+    return sessionmaker(bind=engine)
+
+
+def add_result(session, quiz, start_time, end_time):
+    result = QuizResult(quiz.id, 1, 0, end_time)
+    result.start_time = start_time
+    for question in quiz.questions:
+        result.questions_results.append(QuestionResult(None, question.id, '', False))
+    session.add(result)
+    return result
+
+
+def test_purge():
+    Session = make_session_factory(foreign_keys=True)
+    session = Session()
+    quizzes = [Quiz(1, 'live'), Quiz(1, 'removed')]
+    for quiz in quizzes:
+        quiz.questions = [Question(None, str(i)) for i in range(3)]
+        session.add(quiz)
+    session.flush()
+    live, removed = quizzes
+
+    finished = add_result(session, live, NOW - timedelta(days=30), NOW - timedelta(days=30))
+    running = add_result(session, live, NOW - timedelta(hours=1), None)
+    add_result(session, live, NOW - timedelta(days=30), None)
+    add_result(session, removed, NOW, NOW)
+    for question in removed.questions:
+        session.add(QuestionStats(question_id=question.id, attempts=1, solved=0, solve_rate=0, top_answers='[]'))
+    session.commit()
+    kept_ids = {finished.id, running.id}
+
+    # Сироты, оставшиеся от удаления викторины без проверки внешних ключей
+    session.execute('PRAGMA foreign_keys=OFF')
+    session.query(Quiz).filter_by(id=removed.id).delete()
+    session.commit()
+    session.execute('PRAGMA foreign_keys=ON')
+
+    policy = RetentionPolicy(abandoned_after=timedelta(days=7), results_ttl=None, chunk_size=2)
+    totals = {}
+    for name, deleted in purge(Session, policy, NOW):
+        assert deleted <= policy.chunk_size
+        totals[name] = totals.get(name, 0) + deleted
+    assert totals == {
+        'abandoned answers': 3,
+        'abandoned results': 1,
+        'orphan answers': 3,
+        'orphan results': 1,
+        'orphan question stats': 3,
+        'orphan questions': 3,
+    }
+
+    assert {id for id, in session.query(QuizResult.id)} == kept_ids
+    assert session.query(Question).count() == 3
+    assert session.query(QuestionResult).count() == 6
+
+    policy = RetentionPolicy(abandoned_after=timedelta(days=7), results_ttl=timedelta(days=7), chunk_size=100)
+    assert dict(purge(Session, policy, NOW)) == {'expired answers': 3, 'expired results': 1}
+    assert {id for id, in session.query(QuizResult.id)} == {running.id}
+    session.close()
+
+
+def test_remove_quiz():
+    Session = make_session_factory(foreign_keys=True)
+    session = Session()
+    quizzes = [Quiz(1, 'kept'), Quiz(1, 'removed')]
+    for quiz in quizzes:
+        quiz.questions = [Question(None, str(i)) for i in range(3)]
+        session.add(quiz)
+    session.flush()
+    kept, removed = quizzes
+    for quiz in quizzes:
+        for _ in range(3):
+            add_result(session, quiz, NOW, NOW)
+        for question in quiz.questions:
+            session.add(QuestionStats(question_id=question.id, attempts=3, solved=0, solve_rate=0, top_answers='[]'))
+    session.commit()
+    removed_id = removed.id
+
+    totals = {}
+    for name, deleted in remove_quiz(Session, removed_id, chunk_size=2):
+        assert deleted <= 2
+        totals[name] = totals.get(name, 0) + deleted
+    assert totals == {'answers': 9, 'question stats': 3, 'results': 3, 'questions': 3, 'quiz': 1}
+
+    session.expire_all()
+    assert [quiz.id for quiz in session.query(Quiz)] == [kept.id]
+    assert session.query(Question).count() == 3
+    assert session.query(QuizResult).count() == 3
+    assert session.query(QuestionResult).count() == 9
+    assert session.query(QuestionStats).count() == 3
+    session.close()
@@ -0,0 +1,24 @@
+from sqlalchemy import create_engine, inspect
+
+import migrations
+from models import Base
+
+
+def test_schema_matches_models():
+    engine = create_engine('sqlite:///:memory:')
+    migrations.upgrade(engine)
+
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        columns = {c['name'] for c in inspector.get_columns(table.name)}
+        assert columns == set(table.columns.keys()), table.name
+        indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+        assert indexes == {i.name for i in table.indexes}, table.name
+
+
+def test_upgrade_is_idempotent(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    migrations.upgrade(engine)
+    migrations.upgrade(engine)
+    with engine.connect() as conn:
+        assert migrations.current_version(conn) == migrations.latest_version()
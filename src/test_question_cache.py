@@ -0,0 +1,16 @@
+from question_cache import DiskQuestionCache
+
+
+def test_persistence(tmp_path):
+    path = str(tmp_path / 'questions.db')
+    cache = DiskQuestionCache(path)
+    assert cache.get('gerbr13/98') is None
+    cache.put('gerbr13/98', 'Вопрос', 'Ответ', None)
+    cache.put('leti11.5/5', 'Вопрос 2', 'Ответ 2', 'Зачёт')
+    cache.close()
+
+    cache = DiskQuestionCache(path)
+    assert len(cache) == 2
+    assert cache.get('gerbr13/98') == ('Вопрос', 'Ответ', None)
+    assert cache.get('leti11.5/5') == ('Вопрос 2', 'Ответ 2', 'Зачёт')
+    cache.close()
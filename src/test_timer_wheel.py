@@ -0,0 +1,97 @@
+import time
+import random
+import asyncio
+
+from timer_wheel import TimerWheel, TimerScheduler
+
+
+def test_fires_on_deadline():
+    wheel = TimerWheel(1000)
+    wheel.add('a', 1005, 'payload')
+    assert wheel.advance(1004) == []
+    assert wheel.advance(1005) == [('a', 'payload')]
+    assert len(wheel) == 0
+
+
+def test_overdue_fires_on_next_tick():
+    wheel = TimerWheel(1000)
+    wheel.add('a', 900)
+    assert wheel.advance(1001) == [('a', None)]
+
+
+def test_cancel_and_replace():
+    wheel = TimerWheel(0)
+    wheel.add('a', 10)
+    wheel.add('b', 10)
+    assert wheel.cancel('a')
+    assert not wheel.cancel('a')
+    wheel.add('b', 5000)
+    assert wheel.advance(4999) == []
+    assert wheel.advance(5000) == [('b', None)]
+
+
+def test_far_deadlines():
+    wheel = TimerWheel(123)
+    far = 123 + 64 ** 4 * 3
+    wheel.add('far', far)
+    assert wheel.advance(far - 1) == []
+    assert wheel.advance(far) == [('far', None)]
+
+
+def test_random_against_reference():
+    rnd = random.Random(42)
+    tick = rnd.randint(0, 10 ** 7)
+    wheel = TimerWheel(tick)
+    reference = {}
+    for _ in range(3000):
+        op = rnd.random()
+        if op < 0.5:
+            key = rnd.randint(0, 200)
+            deadline = tick + rnd.choice([rnd.randint(-5, 70), rnd.randint(0, 5000), rnd.randint(0, 300000)])
+            wheel.add(key, deadline)
+            reference[key] = max(deadline, tick + 1)
+        elif op < 0.6:
+            key = rnd.randint(0, 200)
+            assert wheel.cancel(key) == (key in reference)
+            reference.pop(key, None)
+        else:
+            tick += rnd.choice([1, rnd.randint(0, 100), rnd.randint(0, 10000)])
+            expired = {key for key, _ in wheel.advance(tick)}
+            assert expired == {key for key, deadline in reference.items() if deadline <= tick}
+            for key in expired:
+                del reference[key]
+        assert len(wheel) == len(reference)
+
+
+def test_scheduler_runs_callbacks_concurrently():
+    scheduler = TimerScheduler(resolution=0.01, concurrency=3)
+    now = time.time()
+    for key in range(6):
+        scheduler.schedule(key, now - 1)
+
+    running, max_running, fired = 0, 0, []
+    async def on_expire(key, payload):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        # Обработчик долго ходит в сеть
+        await asyncio.sleep(0.2)
+        running -= 1
+        fired.append(key)
+        if key == 0:
+            raise RuntimeError("callback failure does not stop the scheduler")
+
+    async def main():
+        task = asyncio.ensure_future(scheduler.run(on_expire))
+        start = time.monotonic()
+        while len(fired) < 6:
+            await asyncio.sleep(0.01)
+        elapsed = time.monotonic() - start
+        task.cancel()
+        return elapsed
+
+    elapsed = asyncio.run(main())
+    assert sorted(fired) == list(range(6))
+    assert max_running == 3
+    # Две волны по три обработчика, а не шесть подряд
+    assert elapsed < 0.2 * 6 - 0.3
@@ -0,0 +1,169 @@
+import time
+import asyncio
+import logging
+from typing import Any, Dict, Hashable, List, Tuple, Callable, Awaitable
+
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    """Иерархическое колесо таймеров.
+
+    Время дискретно - тики. Уровень `level` состоит из SLOTS слотов,
+    каждый слот покрывает SLOTS ** level тиков. Таймер кладётся на самый
+    нижний уровень, куда он помещается, и при обороте нижнего уровня
+    переносится (cascade) ниже. Вставка и отмена - O(1).
+
+    Ключ таймера уникален: повторная вставка с тем же ключом заменяет таймер.
+    """
+
+    BITS = 6
+    SLOTS = 1 << BITS
+    MASK = SLOTS - 1
+    LEVELS = 4
+
+    def __init__(self, now_tick: int):
+        self._tick = now_tick
+        self._wheels = [[{} for _ in range(self.SLOTS)] for _ in range(self.LEVELS)]
+        # key -> (level, slot)
+        self._index: Dict[Hashable, Tuple[int, int]] = {}
+        # Число таймеров на каждом уровне - чтобы проскакивать пустые участки времени
+        self._counts = [0] * self.LEVELS
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    @property
+    def tick(self) -> int:
+        return self._tick
+
+    def add(self, key: Hashable, deadline_tick: int, payload: Any = None):
+        self.cancel(key)
+        self._place(key, deadline_tick, payload, self._tick + 1)
+
+    def cancel(self, key: Hashable) -> bool:
+        pos = self._index.pop(key, None)
+        if pos is None:
+            return False
+        level, slot = pos
+        del self._wheels[level][slot][key]
+        self._counts[level] -= 1
+        return True
+
+    def advance(self, now_tick: int) -> List[Tuple[Hashable, Any]]:
+        """Прокручивает колесо до now_tick и возвращает истёкшие таймеры (key, payload)"""
+        expired = []
+        while self._tick < now_tick:
+            self._skip_empty(now_tick)
+            self._tick += 1
+            self._cascade()
+            slot = self._tick & self.MASK
+            entries = self._wheels[0][slot]
+            if entries:
+                self._wheels[0][slot] = {}
+                self._counts[0] -= len(entries)
+                for key, (_, payload) in entries.items():
+                    del self._index[key]
+                    expired.append((key, payload))
+        return expired
+
+    def _skip_empty(self, now_tick: int):
+        """Перематывает тики, на которых заведомо ничего не произойдёт"""
+        for level in range(self.LEVELS):
+            if self._counts[level]:
+                break
+        else:
+            self._tick = now_tick - 1
+            return
+        if level == 0:
+            return
+        # Нижние уровни пусты: до ближайшего непустого слота уровня level
+        # (или до оборота этого уровня) ничего не сработает
+        span = 1 << (self.BITS * level)
+        rotation = span << self.BITS
+        rotation_start = self._tick // rotation * rotation
+        target = rotation_start + rotation
+        for slot in range(((self._tick >> (self.BITS * level)) & self.MASK) + 1, self.SLOTS):
+            if self._wheels[level][slot]:
+                target = rotation_start + slot * span
+                break
+        self._tick = max(self._tick, min(target, now_tick) - 1)
+
+    def _cascade(self):
+        for level in range(1, self.LEVELS):
+            if self._tick & ((1 << (self.BITS * level)) - 1):
+                break
+            slot = (self._tick >> (self.BITS * level)) & self.MASK
+            entries = self._wheels[level][slot]
+            if entries:
+                self._wheels[level][slot] = {}
+                self._counts[level] -= len(entries)
+                for key, (deadline, payload) in entries.items():
+                    # Слот нулевого уровня для текущего тика ещё не обработан
+                    self._place(key, deadline, payload, self._tick)
+
+    def _place(self, key, deadline, payload, earliest_tick):
+        # Просроченные таймеры срабатывают на ближайшем тике
+        slot_tick = max(deadline, earliest_tick)
+        delta = slot_tick - self._tick
+        level = 0
+        while level < self.LEVELS - 1 and delta >= (1 << (self.BITS * (level + 1))):
+            level += 1
+        if delta >= (1 << (self.BITS * (level + 1))):
+            # Дальше горизонта колеса - кладём в самый дальний слот, при каскаде таймер переложится
+            slot_tick = self._tick + (1 << (self.BITS * (level + 1))) - 1
+        slot = (slot_tick >> (self.BITS * level)) & self.MASK
+        self._wheels[level][slot][key] = (deadline, payload)
+        self._index[key] = (level, slot)
+        self._counts[level] += 1
+
+
+class TimerScheduler:
+    """Обёртка над TimerWheel для asyncio: тик - resolution секунд реального времени.
+
+    Сработавшие таймеры обрабатывают concurrency воркеров, поэтому медленный
+    обработчик не задерживает ни остальные таймеры, ни продвижение колеса.
+    Обработчики одного ключа могут выполняться одновременно.
+    """
+
+    def __init__(self, resolution: float = 1.0, concurrency: int = 100):
+        self.resolution = resolution
+        self.concurrency = concurrency
+        self.wheel = TimerWheel(self._now_tick())
+
+    def _now_tick(self) -> int:
+        return int(time.time() / self.resolution)
+
+    def __len__(self):
+        return len(self.wheel)
+
+    def schedule(self, key: Hashable, deadline: float, payload: Any = None):
+        """deadline - unix timestamp"""
+        self.wheel.add(key, int(deadline / self.resolution) + 1, payload)
+
+    def cancel(self, key: Hashable) -> bool:
+        return self.wheel.cancel(key)
+
+    async def run(self, on_expire: Callable[[Hashable, Any], Awaitable]):
+        expired = asyncio.Queue()
+        workers = [asyncio.ensure_future(self._worker(expired, on_expire)) for _ in range(self.concurrency)]
+        try:
+            while True:
+                await asyncio.sleep(self.resolution)
+                for item in self.wheel.advance(self._now_tick()):
+                    expired.put_nowait(item)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    async def _worker(self, expired: asyncio.Queue, on_expire: Callable[[Hashable, Any], Awaitable]):
+        while True:
+            key, payload = await expired.get()
+            try:
+                await on_expire(key, payload)
+            except Exception:
+                logger.exception(f"Timer {key} callback failed")